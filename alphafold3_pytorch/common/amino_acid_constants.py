@@ -1,6 +1,11 @@
 """Amino acid constants used in AlphaFold."""
 
-from typing import Final
+import functools
+import sys
+from types import MappingProxyType
+from typing import Final, Sequence, Tuple
+
+import numpy as np
 
 # This mapping is used when we need to store atom data in a format that requires
 # fixed atom data size for every residue (e.g. a numpy array).
@@ -43,20 +48,38 @@ atom_types = [
     "CZ3",
     "NZ",
     "OXT",
-    "_",
-    "_",
-    "_",
-    "_",
-    "_",
-    "_",
-    "_",
-    "_",
-    "_",
-    "_",  # 10 null types.
 ]
 atom_types_set = set(atom_types)
-atom_order = {atom_type: i for i, atom_type in enumerate(atom_types)}
-atom_type_num = len(atom_types)  # := 37 + 10 null types := 47.
+atom_order = MappingProxyType({sys.intern(atom_type): i for i, atom_type in enumerate(atom_types)})
+atom_type_num = len(atom_types)  # := 37.
+
+# This is the fixed atom data size of every residue (e.g., in a numpy array), where
+# indices greater than or equal to `atom_type_num` are reserved for null atom types.
+# NOTE: It must match the number of ligand atom types, since the per-residue arrays of
+# a `Biomolecule` stack residues of all molecule types along a single atom dimension.
+atom_type_num_padded: Final[int] = 47  # := 37 + 10 null types := 47.
+atom_types_padded = atom_types + ["_"] * (atom_type_num_padded - atom_type_num)
+
+
+def pack_chars_u8(strings: Sequence[str], width: int = 1) -> np.ndarray:
+    """Pack (ASCII) strings, each truncated or space-padded to `width` characters, as
+    (read-only) `uint8` character codes.
+
+    :param strings: The strings to pack.
+    :param width: The number of characters to pack of each string.
+    :return: A `uint8` array of shape `(len(strings), width)`.
+    """
+    chars = "".join(string[:width].ljust(width) for string in strings)
+    return np.frombuffer(chars.encode("ascii"), dtype=np.uint8).reshape(-1, width)
+
+
+@functools.cache
+def get_atom_type_first_char_u8() -> np.ndarray:
+    """Get the (read-only) first character of each padded atom type as packed `uint8` codes.
+
+    :return: A `uint8` array of shape `(atom_type_num_padded,)`.
+    """
+    return pack_chars_u8(atom_types_padded).reshape(-1)
 
 
 # This is the standard residue order when coding AA type as a number.
@@ -84,32 +107,61 @@ restypes = [
     "V",
 ]
 min_restype_num = 0  # := 0.
-restype_order = {restype: min_restype_num + i for i, restype in enumerate(restypes)}
+restype_order = MappingProxyType(
+    {sys.intern(restype): min_restype_num + i for i, restype in enumerate(restypes)}
+)
 restype_num = min_restype_num + len(restypes)  # := 0 + 20 := 20.
 
 
-restype_1to3 = {
-    "A": "ALA",
-    "R": "ARG",
-    "N": "ASN",
-    "D": "ASP",
-    "C": "CYS",
-    "Q": "GLN",
-    "E": "GLU",
-    "G": "GLY",
-    "H": "HIS",
-    "I": "ILE",
-    "L": "LEU",
-    "K": "LYS",
-    "M": "MET",
-    "F": "PHE",
-    "P": "PRO",
-    "S": "SER",
-    "T": "THR",
-    "W": "TRP",
-    "Y": "TYR",
-    "V": "VAL",
-}
+@functools.cache
+def get_restype_order_lut() -> np.ndarray:
+    """Get a (read-only) lookup table mapping the ordinal of each (ASCII) one-letter residue type
+    to its index in `restype_order`, with all other characters being mapped to -1.
+
+    :return: An `int8` lookup table of shape `(256,)`.
+    """
+    restype_order_lut = np.full(256, -1, dtype=np.int8)
+    restype_order_lut[[ord(restype) for restype in restypes]] = list(restype_order.values())
+    restype_order_lut.flags.writeable = False
+    return restype_order_lut
+
+
+def restype_order_lookup(restype_chars: np.ndarray) -> np.ndarray:
+    """Vectorized equivalent of `restype_order`, with unknown residue types mapped to -1.
+
+    :param restype_chars: Array of one-letter residue types (of dtype `|S1` or `uint8`).
+    :return: An `int8` array of residue type indices of the same shape as `restype_chars`.
+    """
+    restype_chars = np.asarray(restype_chars)
+    if restype_chars.dtype != np.uint8:
+        restype_chars = np.ascontiguousarray(restype_chars, dtype="|S1").view(np.uint8)
+    return get_restype_order_lut()[restype_chars]
+
+
+restype_1to3 = MappingProxyType(
+    {
+        "A": "ALA",
+        "R": "ARG",
+        "N": "ASN",
+        "D": "ASP",
+        "C": "CYS",
+        "Q": "GLN",
+        "E": "GLU",
+        "G": "GLY",
+        "H": "HIS",
+        "I": "ILE",
+        "L": "LEU",
+        "K": "LYS",
+        "M": "MET",
+        "F": "PHE",
+        "P": "PRO",
+        "S": "SER",
+        "T": "THR",
+        "W": "TRP",
+        "Y": "TYR",
+        "V": "VAL",
+    }
+)
 
 BIOMOLECULE_CHAIN: Final[str] = "polypeptide(L)"
 POLYMER_CHAIN: Final[str] = "polymer"
@@ -120,7 +172,33 @@ POLYMER_CHAIN: Final[str] = "polymer"
 # The latter contains many more, and less common, three letter names as
 # keys and maps many of these to the same one letter name
 # (including 'X' and 'U' which we don't use here).
-restype_3to1 = {v: k for k, v in restype_1to3.items()}
+# NOTE: This must be kept in sync with `restype_1to3`.
+restype_3to1 = MappingProxyType(
+    {
+        "ALA": "A",
+        "ARG": "R",
+        "ASN": "N",
+        "ASP": "D",
+        "CYS": "C",
+        "GLN": "Q",
+        "GLU": "E",
+        "GLY": "G",
+        "HIS": "H",
+        "ILE": "I",
+        "LEU": "L",
+        "LYS": "K",
+        "MET": "M",
+        "PHE": "F",
+        "PRO": "P",
+        "SER": "S",
+        "THR": "T",
+        "TRP": "W",
+        "TYR": "Y",
+        "VAL": "V",
+    }
+)
+if __debug__:
+    assert restype_3to1 == {v: k for k, v in restype_1to3.items()}, "`restype_3to1` is stale."
 
 # Define residue metadata for all unknown amino acid residues.
 unk_restype = "UNK"
@@ -128,6 +206,76 @@ unk_chemtype = "peptide linking"
 unk_chemname = "UNKNOWN AMINO ACID RESIDUE"
 
 resnames = [restype_1to3[r] for r in restypes] + [unk_restype]
+resname_to_idx = MappingProxyType({resname: i for i, resname in enumerate(resnames)})
+
+
+def sort_names(names: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Sort (ASCII) names as (read-only) fixed-width bytes, to enable vectorized (binary search)
+    name lookups with `search_sorted_names`.
+
+    :param names: The names to sort.
+    :return: The sorted names and their indices in `names`.
+    """
+    names_arr = np.array(names, dtype=np.bytes_)
+    names_sort_idx = np.argsort(names_arr)
+    names_sorted = names_arr[names_sort_idx]
+    names_sort_idx.flags.writeable = False
+    names_sorted.flags.writeable = False
+    return names_sorted, names_sort_idx
+
+
+def search_sorted_names(
+    name_arr: np.ndarray, names_sorted: np.ndarray, names_sort_idx: np.ndarray
+) -> np.ndarray:
+    """Look up the indices of an array of names with a binary search over sorted names (see
+    `sort_names`), with unknown names mapped to -1.
+
+    :param name_arr: Array of names (e.g., of dtype `|S3`).
+    :param names_sorted: The sorted names.
+    :param names_sort_idx: The indices of the sorted names in the original names.
+    :return: An integer array of name indices of the same shape as `name_arr`.
+    """
+    name_arr = np.asarray(name_arr, dtype=np.bytes_)
+    pos = np.searchsorted(names_sorted, name_arr).clip(max=len(names_sorted) - 1)
+    return np.where(names_sorted[pos] == name_arr, names_sort_idx[pos], -1)
+
+
+@functools.cache
+def get_sorted_resnames() -> Tuple[np.ndarray, np.ndarray]:
+    """Get all (read-only) residue names in sorted order to enable vectorized (binary search)
+    residue name lookups.
+
+    :return: The sorted `|S3` residue names and their indices in `resnames`.
+    """
+    return sort_names(np.array(resnames, dtype="|S3"))
+
+
+def resname_indices(resname_arr: np.ndarray) -> np.ndarray:
+    """Vectorized equivalent of `resname_to_idx`, with unknown residue names mapped to -1.
+
+    :param resname_arr: Array of residue names (e.g., of dtype `|S3`).
+    :return: An integer array of residue name indices of the same shape as `resname_arr`.
+    """
+    return search_sorted_names(resname_arr, *get_sorted_resnames())
+
+
+@functools.cache
+def get_restype_chars_u8() -> np.ndarray:
+    """Get the (read-only) one-letter residue types as packed `uint8` codes.
+
+    :return: A `uint8` array of shape `(len(restypes),)`.
+    """
+    return pack_chars_u8(restypes).reshape(-1)
+
+
+@functools.cache
+def get_resname_chars_u8() -> np.ndarray:
+    """Get the (read-only) space-padded residue names as packed `uint8` codes.
+
+    :return: A `uint8` array of shape `(len(resnames), 3)`.
+    """
+    return pack_chars_u8(resnames, width=3)
+
 
 # This represents the residue chemical type (i.e., `chemtype`) index of amino acid residues.
 chemtype_num = 0
@@ -42,6 +42,13 @@ MMCIF_PREFIXES_TO_DROP_POST_AF3 = MMCIF_PREFIXES_TO_DROP_POST_PARSING + [
     "_citation_author.",
 ]
 
+# This maps the ordinal of each (extended) ASCII character to
+# the character itself if it is alphabetic and to "" otherwise.
+ALPHABETIC_CHAR_TABLE = tuple(chr(i) if chr(i).isalpha() else "" for i in range(256))
+
+# This flags each byte value that encodes an alphabetic ASCII character.
+ALPHABETIC_BYTE_MASK = np.array([bytes([i]).isalpha() for i in range(256)])
+
 
 @dataclasses.dataclass(frozen=True)
 class Biomolecule:
@@ -217,9 +224,9 @@ def _from_mmcif_object(
                 res_shortname, residue_constants.restype_num
             )
             if is_polymer_residue:
-                pos = np.zeros((residue_constants.atom_type_num, 3))
-                mask = np.zeros((residue_constants.atom_type_num,))
-                res_b_factors = np.zeros((residue_constants.atom_type_num,))
+                pos = np.zeros((residue_constants.atom_type_num_padded, 3))
+                mask = np.zeros((residue_constants.atom_type_num_padded,))
+                res_b_factors = np.zeros((residue_constants.atom_type_num_padded,))
                 for atom in res:
                     if is_polymer_residue and atom.name not in residue_constants.atom_types_set:
                         continue
@@ -257,9 +264,9 @@ def _from_mmcif_object(
                 # into a single ligand residue using indexing operations
                 # working jointly on chain_index and residue_index.
                 for atom in res:
-                    pos = np.zeros((residue_constants.atom_type_num, 3))
-                    mask = np.zeros((residue_constants.atom_type_num,))
-                    res_b_factors = np.zeros((residue_constants.atom_type_num,))
+                    pos = np.zeros((residue_constants.atom_type_num_padded, 3))
+                    mask = np.zeros((residue_constants.atom_type_num_padded,))
+                    res_b_factors = np.zeros((residue_constants.atom_type_num_padded,))
                     atom_name = get_ligand_atom_name(atom.name, residue_constants.atom_types_set)
                     if atom_name not in residue_constants.atom_types_set:
                         atom_name = "ATM"
@@ -363,6 +370,11 @@ def atom_id_to_type(atom_id: str) -> str:
         ValueError: If `atom_id` is empty or does not contain any alphabetic characters.
     """
     assert len(atom_id) > 0, f"Atom ID must have at least one character, but received: {atom_id}."
+    first_char_code = ord(atom_id[0])
+    if first_char_code < 256 and ALPHABETIC_CHAR_TABLE[first_char_code]:
+        # NOTE: Standard atom IDs almost always begin with their element symbol,
+        # so a single table lookup suffices for the common case.
+        return ALPHABETIC_CHAR_TABLE[first_char_code]
     for char in atom_id:
         if char.isalpha():
             return char
@@ -371,6 +383,28 @@ def atom_id_to_type(atom_id: str) -> str:
     )
 
 
+@typecheck
+def atom_ids_to_types(atom_ids: np.ndarray) -> np.ndarray:
+    """Convert an array of atom IDs to atom types in one vectorized pass (see `atom_id_to_type`).
+
+    :param atom_ids: Array of (ASCII) atom IDs, ideally of a fixed-width bytes dtype such as `|S4`.
+    :return: Array of dtype `|S1` and of the same shape as `atom_ids` containing each atom type.
+
+    :raise:
+        ValueError: If any atom ID does not contain any alphabetic characters.
+    """
+    atom_ids = np.ascontiguousarray(atom_ids, dtype=np.bytes_)
+    if atom_ids.size == 0:
+        return np.empty(atom_ids.shape, dtype="|S1")
+    char_codes = atom_ids.reshape(-1).view(np.uint8).reshape(atom_ids.size, -1)
+    is_alpha = ALPHABETIC_BYTE_MASK[char_codes]
+    if not is_alpha.any(axis=-1).all():
+        raise ValueError("All atom IDs must contain at least one alphabetic character.")
+    first_alpha_index = is_alpha.argmax(axis=-1)
+    atom_types = char_codes[np.arange(len(char_codes)), first_alpha_index]
+    return atom_types.view("|S1").reshape(atom_ids.shape)
+
+
 @typecheck
 def remove_metadata_fields_by_prefixes(
     metadata_dict: Dict[str, List[Any]], field_prefixes: List[str]
@@ -703,7 +737,7 @@ def to_mmcif(
             res_atom_names = (
                 unique_res_atom_names[i]
                 if exists(unique_res_atom_names)
-                else [residue_constants.atom_types for _ in range(len(res_atom_positions))]
+                else [residue_constants.atom_types_padded for _ in range(len(res_atom_positions))]
             )
             assert len(res_atom_positions) == len(
                 res_atom_names
@@ -1,6 +1,11 @@
 """Deoxyribonucleic acid (DNA) constants used in AlphaFold."""
 
-from typing import Final
+import functools
+import sys
+from types import MappingProxyType
+from typing import Final, Tuple
+
+import numpy as np
 
 from alphafold3_pytorch.common import amino_acid_constants, rna_constants
 
@@ -35,30 +40,26 @@ atom_types = [
     "O2",
     "O4",
     "O6",
-    "_",
-    "_",
-    "_",
-    "_",
-    "_",
-    "_",
-    "_",
-    "_",
-    "_",
-    "_",
-    "_",
-    "_",
-    "_",
-    "_",
-    "_",
-    "_",
-    "_",
-    "_",
-    "_",
-    "_",  # 20 null types.
 ]
 atom_types_set = set(atom_types)
-atom_order = {atom_type: i for i, atom_type in enumerate(atom_types)}
-atom_type_num = len(atom_types)  # := 27 + 20 null types := 47.
+atom_order = MappingProxyType({sys.intern(atom_type): i for i, atom_type in enumerate(atom_types)})
+atom_type_num = len(atom_types)  # := 27.
+
+# This is the fixed atom data size of every residue (e.g., in a numpy array), where
+# indices greater than or equal to `atom_type_num` are reserved for null atom types.
+# NOTE: It must match the number of ligand atom types, since the per-residue arrays of
+# a `Biomolecule` stack residues of all molecule types along a single atom dimension.
+atom_type_num_padded: Final[int] = 47  # := 27 + 20 null types := 47.
+atom_types_padded = atom_types + ["_"] * (atom_type_num_padded - atom_type_num)
+
+
+@functools.cache
+def get_atom_type_first_char_u8() -> np.ndarray:
+    """Get the (read-only) first character of each padded atom type as packed `uint8` codes.
+
+    :return: A `uint8` array of shape `(atom_type_num_padded,)`.
+    """
+    return amino_acid_constants.pack_chars_u8(atom_types_padded).reshape(-1)
 
 
 # This is the standard residue order when coding DNA type as a number.
@@ -67,16 +68,45 @@ restypes = ["A", "C", "G", "T"]
 min_restype_num = (len(amino_acid_constants.restypes) + 1) + (
     len(rna_constants.restypes) + 1
 )  # := 26.
-restype_order = {restype: min_restype_num + i for i, restype in enumerate(restypes)}
+restype_order = MappingProxyType(
+    {sys.intern(restype): min_restype_num + i for i, restype in enumerate(restypes)}
+)
 restype_num = min_restype_num + len(restypes)  # := 26 + 4 := 30.
 
 
-restype_1to3 = {
-    "A": "DA",
-    "C": "DC",
-    "G": "DG",
-    "T": "DT",
-}
+@functools.cache
+def get_restype_order_lut() -> np.ndarray:
+    """Get a (read-only) lookup table mapping the ordinal of each (ASCII) one-letter residue type
+    to its index in `restype_order`, with all other characters being mapped to -1.
+
+    :return: An `int8` lookup table of shape `(256,)`.
+    """
+    restype_order_lut = np.full(256, -1, dtype=np.int8)
+    restype_order_lut[[ord(restype) for restype in restypes]] = list(restype_order.values())
+    restype_order_lut.flags.writeable = False
+    return restype_order_lut
+
+
+def restype_order_lookup(restype_chars: np.ndarray) -> np.ndarray:
+    """Vectorized equivalent of `restype_order`, with unknown residue types mapped to -1.
+
+    :param restype_chars: Array of one-letter residue types (of dtype `|S1` or `uint8`).
+    :return: An `int8` array of residue type indices of the same shape as `restype_chars`.
+    """
+    restype_chars = np.asarray(restype_chars)
+    if restype_chars.dtype != np.uint8:
+        restype_chars = np.ascontiguousarray(restype_chars, dtype="|S1").view(np.uint8)
+    return get_restype_order_lut()[restype_chars]
+
+
+restype_1to3 = MappingProxyType(
+    {
+        "A": "DA",
+        "C": "DC",
+        "G": "DG",
+        "T": "DT",
+    }
+)
 
 BIOMOLECULE_CHAIN: Final[str] = "polydeoxyribonucleotide"
 POLYMER_CHAIN: Final[str] = "polymer"
@@ -86,7 +116,17 @@ POLYMER_CHAIN: Final[str] = "polymer"
 # by being a simple 1-to-1 mapping of 3 letter names to one letter names.
 # The latter contains many more, and less common, three letter names as
 # keys and maps many of these to the same one letter name.
-restype_3to1 = {v: k for k, v in restype_1to3.items()}
+# NOTE: This must be kept in sync with `restype_1to3`.
+restype_3to1 = MappingProxyType(
+    {
+        "DA": "A",
+        "DC": "C",
+        "DG": "G",
+        "DT": "T",
+    }
+)
+if __debug__:
+    assert restype_3to1 == {v: k for k, v in restype_1to3.items()}, "`restype_3to1` is stale."
 
 # Define residue metadata for all unknown DNA residues.
 unk_restype = "DN"
@@ -94,6 +134,45 @@ unk_chemtype = "DNA linking"
 unk_chemname = "UNKNOWN DNA RESIDUE"
 
 resnames = [restype_1to3[r] for r in restypes] + [unk_restype]
+resname_to_idx = MappingProxyType({resname: i for i, resname in enumerate(resnames)})
+
+
+@functools.cache
+def get_sorted_resnames() -> Tuple[np.ndarray, np.ndarray]:
+    """Get all (read-only) residue names in sorted order to enable vectorized (binary search)
+    residue name lookups.
+
+    :return: The sorted `|S3` residue names and their indices in `resnames`.
+    """
+    return amino_acid_constants.sort_names(np.array(resnames, dtype="|S3"))
+
+
+def resname_indices(resname_arr: np.ndarray) -> np.ndarray:
+    """Vectorized equivalent of `resname_to_idx`, with unknown residue names mapped to -1.
+
+    :param resname_arr: Array of residue names (e.g., of dtype `|S3`).
+    :return: An integer array of residue name indices of the same shape as `resname_arr`.
+    """
+    return amino_acid_constants.search_sorted_names(resname_arr, *get_sorted_resnames())
+
+
+@functools.cache
+def get_restype_chars_u8() -> np.ndarray:
+    """Get the (read-only) one-letter residue types as packed `uint8` codes.
+
+    :return: A `uint8` array of shape `(len(restypes),)`.
+    """
+    return amino_acid_constants.pack_chars_u8(restypes).reshape(-1)
+
+
+@functools.cache
+def get_resname_chars_u8() -> np.ndarray:
+    """Get the (read-only) space-padded residue names as packed `uint8` codes.
+
+    :return: A `uint8` array of shape `(len(resnames), 3)`.
+    """
+    return amino_acid_constants.pack_chars_u8(resnames, width=3)
+
 
 # This represents the residue chemical type (i.e., `chemtype`) index of DNA residues.
 chemtype_num = rna_constants.chemtype_num + 1  # := 2.
@@ -1,7 +1,12 @@
 """Ligand constants used in AlphaFold."""
 
+import functools
+import sys
+from types import MappingProxyType
 from typing import Final
 
+import numpy as np
+
 from alphafold3_pytorch.common import amino_acid_constants, dna_constants
 
 # This mapping is used when we need to store atom data in a format that requires
@@ -57,14 +62,29 @@ atom_types = [
     "ATM",
 ]
 atom_types_set = set(atom_types)
-atom_order = {atom_type: i for i, atom_type in enumerate(atom_types)}
+atom_order = MappingProxyType({sys.intern(atom_type): i for i, atom_type in enumerate(atom_types)})
 atom_type_num = len(atom_types)  # := 47.
 
+# This is the fixed atom data size of every residue (e.g., in a numpy array).
+atom_type_num_padded: Final[int] = 47  # := 47 + 0 null types.
+atom_types_padded = atom_types
+
+
+@functools.cache
+def get_atom_type_first_char_u8() -> np.ndarray:
+    """Get the (read-only) first character of each padded atom type as packed `uint8` codes.
+
+    :return: A `uint8` array of shape `(atom_type_num_padded,)`.
+    """
+    return amino_acid_constants.pack_chars_u8(atom_types_padded).reshape(-1)
+
 
 # All ligand residues are mapped to the unknown amino acid type index (:= 20).
 restypes = ["UNL"]
 min_restype_num = len(amino_acid_constants.restypes)  # := 20.
-restype_order = {restype: min_restype_num + i for i, restype in enumerate(restypes)}
+restype_order = MappingProxyType(
+    {sys.intern(restype): min_restype_num + i for i, restype in enumerate(restypes)}
+)
 restype_num = len(amino_acid_constants.restypes)  # := 20.
 
 BIOMOLECULE_CHAIN: Final[str] = "other"
@@ -73,7 +93,7 @@ POLYMER_CHAIN: Final[str] = "non-polymer"
 
 # NB: restype_3to1 serves as a placeholder for mapping all
 # ligand residues to the unknown amino acid type index (:= 20).
-restype_3to1 = {}
+restype_3to1 = MappingProxyType({})
 
 # Define residue metadata for all unknown ligand residues.
 unk_restype = "UNL"
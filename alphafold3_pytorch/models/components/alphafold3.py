@@ -6,18 +6,18 @@ from math import pi, sqrt
 from pathlib import Path
 from typing import Dict, List, Literal, NamedTuple, Tuple
 
-import einx
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from colt5_attention import ConditionalRoutedAttention
-from einops import einsum, pack, rearrange, reduce, repeat, unpack
+from einops import einsum, rearrange, repeat
 from einops.layers.torch import Rearrange
 from frame_averaging_pytorch import FrameAverage
 from huggingface_hub import PyTorchModelHubMixin, hf_hub_download
 from taylor_series_linear_attention import TaylorSeriesLinearAttn
 from torch import Tensor
 from torch.nn import Linear, Module, ModuleList, Sequential
+from torch.utils.checkpoint import checkpoint
 from tqdm import tqdm
 
 from alphafold3_pytorch.models.components.attention import (
@@ -38,11 +38,10 @@ from alphafold3_pytorch.utils.model_utils import (
     max_neg_value,
     maybe,
     mean_pool_with_lens,
-    pack_one,
     pad_and_window,
     pad_or_slice_to,
+    pairwise_distances,
     repeat_consecutive_with_lens,
-    unpack_one,
 )
 from alphafold3_pytorch.utils.tensor_typing import Bool, Float, Int, typecheck
 from alphafold3_pytorch.utils.utils import default, exists, identity
@@ -111,20 +110,36 @@ class LinearNoBiasThenOuterSum(Module):
     def __init__(self, dim, dim_out=None):
         super().__init__()
         dim_out = default(dim_out, dim)
+        self.dim_out = dim_out
         self.proj = LinearNoBias(dim, dim_out * 2)
 
     @typecheck
     def forward(
-        self, t: Float["b n ds"]  # type: ignore
+        self,
+        t: Float["b n ds"],  # type: ignore
+        residual: Float["b n n dp"] | None = None,  # type: ignore
     ) -> Float["b n n dp"]:  # type: ignore
         """
         Perform the forward pass.
 
         :param t: The input tensor.
+        :param residual: An optional pairwise tensor to add the outer sum onto.
         :return: The output tensor.
         """
-        single_i, single_j = self.proj(t).chunk(2, dim=-1)
-        out = einx.add("b i d, b j d -> b i j d", single_i, single_j)
+        # slice views out of the single projection, and broadcast both halves
+        # straight into the outer sum output
+
+        proj = self.proj(t)
+        single_i, single_j = proj[..., : self.dim_out], proj[..., self.dim_out :]
+
+        if not exists(residual):
+            return single_i[:, :, None, :] + single_j[:, None, :, :]
+
+        # broadcast both halves onto the residual, accumulating the second in place
+        # such that only a single pairwise tensor is allocated
+
+        out = residual + single_i[:, :, None, :]
+        out += single_j[:, None, :, :]
         return out
 
 
@@ -147,13 +162,21 @@ class SwiGLU(Module):
         :return: The output tensor.
         """
         x, gates = x.chunk(2, dim=-1)
-        return F.silu(gates) * x
+        out = F.silu(gates)
+
+        # when no gradients are needed, gate in-place rather than allocating
+        # another hidden-sized intermediate for the product
+
+        if not (torch.is_grad_enabled() and x.requires_grad):
+            return out.mul_(x)
+
+        return out * x
 
 
 class Transition(Module):
     """A Transition module."""
 
-    def __init__(self, *, dim, expansion_factor=4):
+    def __init__(self, *, dim, expansion_factor=4, enable_bf16_autocast=False):
         super().__init__()
         dim_inner = int(dim * expansion_factor)
 
@@ -163,6 +186,11 @@ class Transition(Module):
             LinearNoBias(dim_inner, dim),
         )
 
+        # optionally run the feedforward matmuls in bfloat16, handing the output back
+        # in the precision of the input so the residual stream stays in float32
+
+        self.enable_bf16_autocast = enable_bf16_autocast
+
     @typecheck
     def forward(
         self, x: Float["... d"]  # type: ignore
@@ -173,7 +201,13 @@ class Transition(Module):
         :param x: The input tensor.
         :return: The output tensor.
         """
-        return self.ff(x)
+        if not self.enable_bf16_autocast:
+            return self.ff(x)
+
+        with torch.autocast(device_type=x.device.type, dtype=torch.bfloat16):
+            out = self.ff(x)
+
+        return out.type(x.dtype)
 
 
 # dropout
@@ -202,6 +236,12 @@ class Dropout(Module):
                 t.ndim == 4
             ), "Tensor `t` must consist of 4 dimensions for row/col structured dropout."
 
+        # dropout is an identity at inference or without a dropout probability,
+        # so skip building the structured dropout mask altogether
+
+        if not self.training or self.dropout.p == 0.0:
+            return t
+
         if not exists(self.dropout_type):
             return self.dropout(t)
 
@@ -213,8 +253,14 @@ class Dropout(Module):
             batch, _, col, _ = t.shape
             ones_shape = (batch, 1, col, 1)
 
-        ones = t.new_ones(ones_shape)
-        dropped = self.dropout(ones)
+        # sample the structured keep mask directly, already scaled by the keep probability
+
+        keep_prob = 1.0 - self.dropout.p
+        dropped = t.new_empty(ones_shape).bernoulli_(keep_prob)
+
+        if keep_prob > 0.0:
+            dropped.div_(keep_prob)
+
         return t * dropped
 
 
@@ -262,9 +308,37 @@ class AdaptiveLayerNorm(Module):
         self.norm = nn.LayerNorm(dim, elementwise_affine=False)
         self.norm_cond = nn.LayerNorm(dim_cond, bias=False)
 
-        self.to_gamma = nn.Sequential(Linear(dim_cond, dim), nn.Sigmoid())
+        # the gamma and beta projections are packed into one matmul,
+        # with only gamma receiving a bias, initialized as `nn.Linear` would
+
+        self.to_gamma_beta = LinearNoBias(dim_cond, dim * 2)
+
+        self.gamma_bias = nn.Parameter(torch.empty(dim))
+        nn.init.uniform_(self.gamma_bias, -(dim_cond**-0.5), dim_cond**-0.5)
+
+        # checkpoints with separate `to_gamma` and `to_beta` projections are packed on load
+
+        self._register_load_state_dict_pre_hook(self.pack_gamma_beta_state_dict)
+
+    @staticmethod
+    def pack_gamma_beta_state_dict(state_dict: dict, prefix: str, *args):
+        """
+        Pack the parameters of the separate gamma and beta projections, as saved by earlier
+        versions of this module, into the packed gamma and beta projection, in place.
+
+        :param state_dict: The state dictionary being loaded.
+        :param prefix: The prefix of the parameters of this module.
+        """
+        gamma_weight_key = f"{prefix}to_gamma.0.weight"
+
+        if gamma_weight_key not in state_dict:
+            return
 
-        self.to_beta = LinearNoBias(dim_cond, dim)
+        gamma_weight = state_dict.pop(gamma_weight_key)
+        beta_weight = state_dict.pop(f"{prefix}to_beta.weight")
+
+        state_dict[f"{prefix}to_gamma_beta.weight"] = torch.cat((gamma_weight, beta_weight))
+        state_dict[f"{prefix}gamma_bias"] = state_dict.pop(f"{prefix}to_gamma.0.bias")
 
     @typecheck
     def forward(
@@ -282,9 +356,60 @@ class AdaptiveLayerNorm(Module):
         normed = self.norm(x)
         normed_cond = self.norm_cond(cond)
 
-        gamma = self.to_gamma(normed_cond)
-        beta = self.to_beta(normed_cond)
-        return normed * gamma + beta
+        gamma, beta = self.to_gamma_beta(normed_cond).chunk(2, dim=-1)
+        gamma = (gamma + self.gamma_bias).sigmoid()
+
+        return torch.addcmul(beta, normed, gamma)
+
+
+class LayerNormLinearNoBias(nn.Sequential):
+    """A LayerNorm followed by a LinearNoBias projection to a few output channels.
+
+    Laid out as `nn.Sequential(nn.LayerNorm, LinearNoBias)`, so that its parameters keep the
+    names of the unfused modules in state dictionaries.
+    """
+
+    def __init__(self, dim, dim_out):
+        super().__init__(nn.LayerNorm(dim), LinearNoBias(dim, dim_out))
+
+    @property
+    def norm(self) -> nn.LayerNorm:
+        """The LayerNorm."""
+        return self[0]
+
+    @property
+    def proj(self) -> Linear:
+        """The LinearNoBias projection."""
+        return self[1]
+
+    @typecheck
+    def forward(
+        self, x: Float["... d"]  # type: ignore
+    ) -> Float["... do"]:  # type: ignore
+        """
+        Perform the forward pass.
+
+        The LayerNorm affine parameters are folded into the projection, and the
+        normalization is applied to the projected output, so the normalized input
+        is never materialized. This is the same as `proj(norm(x))`.
+
+        :param x: The input tensor.
+        :return: The output tensor.
+        """
+        # kept in float32, as the folded form subtracts two terms of similar magnitude
+
+        with torch.autocast(device_type=x.device.type, enabled=False):
+            x = x.float()
+
+            weight = self.proj.weight * self.norm.weight
+            bias = self.proj.weight @ self.norm.bias
+
+            var, mean = torch.var_mean(x, dim=-1, keepdim=True, correction=0)
+
+            out = F.linear(x, weight) - mean * weight.sum(dim=-1)
+            out = out * torch.rsqrt(var + self.norm.eps) + bias
+
+        return out
 
 
 class ConditionWrapper(Module):
@@ -360,10 +485,7 @@ class TriangleMultiplication(Module):
 
         self.out_gate = LinearNoBias(dim, dim_hidden)
 
-        if mix == "outgoing":
-            self.mix_einsum_eq = "... i k d, ... j k d -> ... i j d"
-        elif mix == "incoming":
-            self.mix_einsum_eq = "... k j d, ... k i d -> ... i j d"
+        self.mix = mix
 
         self.to_out_norm = nn.LayerNorm(dim_hidden)
 
@@ -377,26 +499,42 @@ class TriangleMultiplication(Module):
         self,
         x: Float["b n n d"],  # type: ignore
         mask: Bool["b n"] | None = None,  # type: ignore
+        pair_mask: Bool["b n n"] | None = None,  # type: ignore
     ) -> Float["b n n d"]:  # type: ignore
         """
         Perform the forward pass.
 
         :param x: The input tensor.
         :param mask: The mask tensor.
+        :param pair_mask: The precomputed pairwise mask tensor, derived from `mask` if not given.
         :return: The output tensor.
         """
-        if exists(mask):
-            mask = einx.logical_and("b i, b j -> b i j 1", mask, mask)
+        if exists(mask) and not exists(pair_mask):
+            pair_mask = mask[:, :, None] & mask[:, None, :]
 
         x = self.norm(x)
 
         left, right = self.left_right_proj(x).chunk(2, dim=-1)
 
-        if exists(mask):
-            left = left * mask
-            right = right * mask
+        if exists(pair_mask):
+            pair_mask = pair_mask[..., None]
+            left = left * pair_mask
+            right = right * pair_mask
+
+        # each feature channel is an independent matrix product, so move it to the batch dimension
+        # and let a single batched matmul carry out the contraction over `k`
 
-        out = einsum(left, right, self.mix_einsum_eq)
+        left = rearrange(left, "b i j d -> b d i j")
+        right = rearrange(right, "b i j d -> b d i j")
+
+        if self.mix == "outgoing":
+            # ... i k d, ... j k d -> ... i j d
+            out = left @ right.transpose(-1, -2)
+        elif self.mix == "incoming":
+            # ... k j d, ... k i d -> ... i j d
+            out = right.transpose(-1, -2) @ left
+
+        out = rearrange(out, "b d i j -> b i j d")
 
         out = self.to_out_norm(out)
 
@@ -414,23 +552,33 @@ class TriangleMultiplication(Module):
 class AttentionPairBias(Module):
     """An Attention module with pair bias computation."""
 
-    def __init__(self, *, heads, dim_pairwise, window_size=None, num_memory_kv=0, **attn_kwargs):
+    def __init__(
+        self,
+        *,
+        heads,
+        dim_pairwise,
+        window_size=None,
+        num_memory_kv=0,
+        enable_bf16_autocast=False,
+        **attn_kwargs,
+    ):
         super().__init__()
 
         self.window_size = window_size
 
+        # optionally run the pair bias projection and attention in bfloat16,
+        # with autocast keeping the layernorm statistics and softmax in float32
+
+        self.enable_bf16_autocast = enable_bf16_autocast
+
         self.attn = Attention(
             heads=heads, window_size=window_size, num_memory_kv=num_memory_kv, **attn_kwargs
         )
 
         # line 8 of Algorithm 24
 
-        to_attn_bias_linear = LinearNoBias(dim_pairwise, heads)
-        nn.init.zeros_(to_attn_bias_linear.weight)
-
-        self.to_attn_bias = nn.Sequential(
-            nn.LayerNorm(dim_pairwise), to_attn_bias_linear, Rearrange("b ... h -> b h ...")
-        )
+        self.to_attn_bias = LayerNormLinearNoBias(dim_pairwise, heads)
+        nn.init.zeros_(self.to_attn_bias.proj.weight)
 
     @typecheck
     def forward(
@@ -481,11 +629,19 @@ class AttentionPairBias(Module):
         else:
             attn_bias = 0.0
 
-        attn_bias = self.to_attn_bias(pairwise_repr) + attn_bias
+        with torch.autocast(
+            device_type=single_repr.device.type,
+            dtype=torch.bfloat16,
+            enabled=self.enable_bf16_autocast,
+        ):
+            pairwise_attn_bias = self.to_attn_bias(pairwise_repr)
+            attn_bias = rearrange(pairwise_attn_bias, "b ... h -> b h ...") + attn_bias
 
-        out = self.attn(single_repr, attn_bias=attn_bias, **kwargs)
+            out = self.attn(single_repr, attn_bias=attn_bias, **kwargs)
 
-        return out
+        # residuals are accumulated by the caller in the precision of the inputs
+
+        return out.type(single_repr.dtype)
 
 
 class TriangleAttention(Module):
@@ -499,12 +655,18 @@ class TriangleAttention(Module):
         node_type: Literal["starting", "ending"],
         dropout=0.0,
         dropout_type: Literal["row", "col"] | None = None,
+        flash=False,
         **attn_kwargs,
     ):
         super().__init__()
         self.need_transpose = node_type == "ending"
 
-        self.attn = Attention(dim=dim, heads=heads, **attn_kwargs)
+        # triangle attention is carried out over (b * n) rows of n x n attention matrices,
+        # which share one triangle bias per batch element - the fused scaled dot product
+        # attention kernels need that bias expanded across the rows as an additive mask,
+        # so they are only used when `flash` is set
+
+        self.attn = Attention(dim=dim, heads=heads, flash=flash, **attn_kwargs)
 
         self.dropout = Dropout(dropout, dropout_type=dropout_type)
 
@@ -531,17 +693,20 @@ class TriangleAttention(Module):
 
         attn_bias = self.to_attn_bias(pairwise_repr)
 
-        batch_repeat = pairwise_repr.shape[1]
-        attn_bias = repeat(attn_bias, "b ... -> (b repeat) ...", repeat=batch_repeat)
+        # the attention bias is shared across all rows, so rather than repeating it
+        # for every row, give it a singleton dimension to broadcast against the packed rows
+
+        batch, batch_repeat = pairwise_repr.shape[:2]
+        attn_bias = rearrange(attn_bias, "b ... -> b 1 ...")
 
         if exists(mask):
             mask = repeat(mask, "b ... -> (b repeat) ...", repeat=batch_repeat)
 
-        pairwise_repr, packed_shape = pack_one(pairwise_repr, "* n d")
+        pairwise_repr = pairwise_repr.flatten(0, 1)
 
         out = self.attn(pairwise_repr, mask=mask, attn_bias=attn_bias, **kwargs)
 
-        out = unpack_one(out, packed_shape, "* n d")
+        out = out.unflatten(0, (batch, batch_repeat))
 
         if self.need_transpose:
             out = rearrange(out, "b j i d -> b i j d")
@@ -566,6 +731,7 @@ class PairwiseBlock(Module):
         tri_attn_heads=4,
         dropout_row_prob=0.25,
         dropout_col_prob=0.25,
+        transition_bf16_autocast=False,
     ):
         super().__init__()
 
@@ -607,7 +773,9 @@ class PairwiseBlock(Module):
                 **tri_attn_kwargs,
             )
         )
-        self.pairwise_transition = pre_ln(Transition(dim=dim_pairwise))
+        self.pairwise_transition = pre_ln(
+            Transition(dim=dim_pairwise, enable_bf16_autocast=transition_bf16_autocast)
+        )
 
     @typecheck
     def forward(
@@ -615,16 +783,27 @@ class PairwiseBlock(Module):
         *,
         pairwise_repr: Float["b n n d"],  # type: ignore
         mask: Bool["b n"] | None = None,  # type: ignore
+        pair_mask: Bool["b n n"] | None = None,  # type: ignore
     ):
         """
         Perform the forward pass.
 
         :param pairwise_repr: The pairwise representation tensor.
         :param mask: The mask tensor.
+        :param pair_mask: The precomputed pairwise mask tensor, derived from `mask` if not given.
         :return: The output tensor.
         """
-        pairwise_repr = self.tri_mult_outgoing(pairwise_repr, mask=mask) + pairwise_repr
-        pairwise_repr = self.tri_mult_incoming(pairwise_repr, mask=mask) + pairwise_repr
+        # derive the pairwise mask once for both triangle multiplications
+
+        if exists(mask) and not exists(pair_mask):
+            pair_mask = mask[:, :, None] & mask[:, None, :]
+
+        pairwise_repr = (
+            self.tri_mult_outgoing(pairwise_repr, mask=mask, pair_mask=pair_mask) + pairwise_repr
+        )
+        pairwise_repr = (
+            self.tri_mult_incoming(pairwise_repr, mask=mask, pair_mask=pair_mask) + pairwise_repr
+        )
         pairwise_repr = self.tri_attn_starting(pairwise_repr, mask=mask) + pairwise_repr
         pairwise_repr = self.tri_attn_ending(pairwise_repr, mask=mask) + pairwise_repr
 
@@ -652,6 +831,7 @@ class OuterProductMean(Module):
         *,
         mask: Bool["b n"] | None = None,  # type: ignore
         msa_mask: Bool["b s"] | None = None,  # type: ignore
+        pair_mask: Bool["b n n"] | None = None,  # type: ignore
     ) -> Float["b n n dp"]:  # type: ignore
         """
         Perform the forward pass.
@@ -659,8 +839,12 @@ class OuterProductMean(Module):
         :param msa: The MSA tensor.
         :param mask: The mask tensor.
         :param msa_mask: The MSA mask tensor.
+        :param pair_mask: The precomputed pairwise mask tensor, derived from `mask` if not given.
         :return: The output tensor.
         """
+        if exists(mask) and not exists(pair_mask):
+            pair_mask = mask[:, :, None] & mask[:, None, :]
+
         msa = self.norm(msa)
 
         # line 2
@@ -670,30 +854,31 @@ class OuterProductMean(Module):
         # maybe masked mean for outer product
 
         if exists(msa_mask):
-            a = einx.multiply("b s i d, b s -> b s i d", a, msa_mask.float())
-            b = einx.multiply("b s j e, b s -> b s j e", b, msa_mask.float())
-
-            outer_product = einsum(a, b, "b s i d, b s j e -> b i j d e")
+            # masking one side is sufficient, as masked rows then contribute zero
+            # to the contraction over `s`
 
-            num_msa = reduce(msa_mask.float(), "... s -> ...", "sum")
+            a = a * msa_mask.float()[:, :, None, None]
 
-            outer_product_mean = einx.divide(
-                "b i j d e, b", outer_product, num_msa.clamp(min=self.eps)
-            )
+            num_msa = msa_mask.float().sum(dim=-1).clamp(min=self.eps)[:, None, None, None]
         else:
             num_msa = msa.shape[1]
-            outer_product = einsum(a, b, "b s i d, b s j e -> b i j d e")
-            outer_product_mean = outer_product / num_msa
 
-        # flatten
+        # contract over the msa rows first, as a single batched matmul of (i d) x s with s x (j e),
+        # which also leaves the outer product already flattened along its feature dimensions
+
+        dim_hidden = a.shape[-1]
+
+        outer_product = rearrange(a, "b s i d -> b (i d) s") @ rearrange(b, "b s j e -> b s (j e)")
+        outer_product = rearrange(
+            outer_product, "b (i d) (j e) -> b i j (d e)", d=dim_hidden, e=dim_hidden
+        )
 
-        outer_product_mean = rearrange(outer_product_mean, "... d e -> ... (d e)")
+        outer_product_mean = outer_product / num_msa
 
         # masking for pairwise repr
 
-        if exists(mask):
-            mask = einx.logical_and("b i , b j -> b i j 1", mask, mask)
-            outer_product_mean = outer_product_mean * mask
+        if exists(pair_mask):
+            outer_product_mean = outer_product_mean * pair_mask[..., None]
 
         pairwise_repr = self.to_pairwise_repr(outer_product_mean)
         return pairwise_repr
@@ -721,11 +906,7 @@ class MSAPairWeightedAveraging(Module):
             Rearrange("b s n (gv h d) -> gv b h s n d", gv=2, h=heads),
         )
 
-        self.pairwise_repr_to_attn = nn.Sequential(
-            nn.LayerNorm(dim_pairwise),
-            LinearNoBias(dim_pairwise, heads),
-            Rearrange("b i j h -> b h i j"),
-        )
+        self.pairwise_repr_to_attn = LayerNormLinearNoBias(dim_pairwise, heads)
 
         self.to_out = nn.Sequential(
             Rearrange("b h s n d -> b s n (h d)"),
@@ -754,11 +935,14 @@ class MSAPairWeightedAveraging(Module):
 
         # line 3
 
-        b = self.pairwise_repr_to_attn(pairwise_repr)
+        b = rearrange(self.pairwise_repr_to_attn(pairwise_repr), "b i j h -> b h i j")
+
+        # the logits are freshly projected, so they can be masked in place before the
+        # softmax, without allocating another (b, h, n, n) tensor
 
         if exists(mask):
             mask = rearrange(mask, "b j -> b 1 1 j")
-            b = b.masked_fill(~mask, max_neg_value(b))
+            b.masked_fill_(~mask, max_neg_value(b))
 
         # line 5
 
@@ -766,7 +950,14 @@ class MSAPairWeightedAveraging(Module):
 
         # line 6
 
-        out = einsum(weights, values, "b h i j, b h s j d -> b h s i d")
+        # fold the msa rows into the feature dimension so the weighted average
+        # over `j` is carried out by one batched matmul
+
+        num_msa = values.shape[2]
+
+        values = rearrange(values, "b h s j d -> b h j (s d)")
+        out = weights @ values
+        out = rearrange(out, "b h i (s d) -> b h s i d", s=num_msa)
 
         out = out * gates
 
@@ -793,6 +984,7 @@ class MSAModule(Module):
         pairwise_block_kwargs: dict = dict(),
         max_num_msa: int | None = None,
         layerscale_output: bool = True,
+        checkpoint_layers: bool = False,
     ):
         super().__init__()
 
@@ -843,10 +1035,53 @@ class MSAModule(Module):
 
         self.layers = layers
 
+        # recompute each layer's activations during the backward pass,
+        # rather than keeping the pairwise activations of every layer in memory
+
+        self.checkpoint_layers = checkpoint_layers
+
         self.layerscale_output = (
             nn.Parameter(torch.zeros(dim_pairwise)) if layerscale_output else 1.0
         )
 
+    @staticmethod
+    def _forward_layer(
+        layer: ModuleList,
+        msa: Float["b s n dm"],  # type: ignore
+        pairwise_repr: Float["b n n dp"],  # type: ignore
+        mask: Bool["b n"] | None = None,  # type: ignore
+        msa_mask: Bool["b s"] | None = None,  # type: ignore
+        pair_mask: Bool["b n n"] | None = None,  # type: ignore
+    ) -> Tuple[Float["b s n dm"], Float["b n n dp"]]:  # type: ignore
+        """
+        Run a single MSA module layer.
+
+        :param layer: The modules making up the MSA module layer.
+        :param msa: The MSA tensor.
+        :param pairwise_repr: The pairwise representation tensor.
+        :param mask: The mask tensor.
+        :param msa_mask: The MSA mask tensor.
+        :param pair_mask: The pairwise mask tensor.
+        :return: The updated MSA and pairwise representation tensors.
+        """
+        outer_product_mean, msa_pair_weighted_avg, msa_transition, pairwise_block = layer
+
+        # communication between msa and pairwise rep
+
+        pairwise_repr = (
+            outer_product_mean(msa, mask=mask, msa_mask=msa_mask, pair_mask=pair_mask)
+            + pairwise_repr
+        )
+
+        msa = msa_pair_weighted_avg(msa=msa, pairwise_repr=pairwise_repr, mask=mask) + msa
+        msa = msa_transition(msa) + msa
+
+        # pairwise block
+
+        pairwise_repr = pairwise_block(pairwise_repr=pairwise_repr, mask=mask, pair_mask=pair_mask)
+
+        return msa, pairwise_repr
+
     @typecheck
     def forward(
         self,
@@ -872,22 +1107,26 @@ class MSAModule(Module):
         # sample without replacement
 
         if num_msa > self.max_num_msa:
-            rand = torch.randn((batch, num_msa), device=device)
+            # uniform noise in [0, 1) offset by the msa mask ranks all present alignments
+            # above the padding, so a single topk yields a random subset of the valid ones.
+            # the subset is random already, so the selected indices need not be sorted
+
+            rand = torch.rand((batch, num_msa), device=device)
 
             if exists(msa_mask):
-                rand.masked_fill_(~msa_mask, max_neg_value(msa))
+                rand.add_(msa_mask)
 
-            indices = rand.topk(self.max_num_msa, dim=-1).indices
+            indices = rand.topk(self.max_num_msa, dim=-1, sorted=False).indices
 
-            msa = einx.get_at("b [s] n dm, b sampled -> b sampled n dm", msa, indices)
+            msa = msa.gather(1, indices[..., None, None].expand(-1, -1, *msa.shape[2:]))
 
             if exists(msa_mask):
-                msa_mask = einx.get_at("b [s], b sampled -> b sampled", msa_mask, indices)
+                msa_mask = msa_mask.gather(1, indices)
 
         # account for no msa
 
         if exists(msa_mask):
-            has_msa = reduce(msa_mask, "b s -> b", "any")
+            has_msa = msa_mask.any(dim=-1)
 
         # process msa
 
@@ -897,25 +1136,34 @@ class MSAModule(Module):
 
         msa = rearrange(single_msa_feats, "b n d -> b 1 n d") + msa
 
-        for (
-            outer_product_mean,
-            msa_pair_weighted_avg,
-            msa_transition,
-            pairwise_block,
-        ) in self.layers:
-            # communication between msa and pairwise rep
+        # the pairwise mask is derived once and shared by all layers
 
-            pairwise_repr = outer_product_mean(msa, mask=mask, msa_mask=msa_mask) + pairwise_repr
+        pair_mask = None
 
-            msa = msa_pair_weighted_avg(msa=msa, pairwise_repr=pairwise_repr, mask=mask) + msa
-            msa = msa_transition(msa) + msa
+        if exists(mask):
+            pair_mask = mask[:, :, None] & mask[:, None, :]
 
-            # pairwise block
+        should_checkpoint = self.checkpoint_layers and self.training and torch.is_grad_enabled()
 
-            pairwise_repr = pairwise_block(pairwise_repr=pairwise_repr, mask=mask)
+        for layer in self.layers:
+            if should_checkpoint:
+                msa, pairwise_repr = checkpoint(
+                    self._forward_layer,
+                    layer,
+                    msa,
+                    pairwise_repr,
+                    mask,
+                    msa_mask,
+                    pair_mask,
+                    use_reentrant=False,
+                )
+            else:
+                msa, pairwise_repr = self._forward_layer(
+                    layer, msa, pairwise_repr, mask, msa_mask, pair_mask
+                )
 
         if exists(msa_mask):
-            pairwise_repr = einx.where("b, b ..., -> b ...", has_msa, pairwise_repr, 0.0)
+            pairwise_repr = torch.where(has_msa[:, None, None, None], pairwise_repr, 0.0)
 
         return pairwise_repr * self.layerscale_output
 
@@ -939,6 +1187,7 @@ class PairformerStack(Module):
         num_register_tokens=0,
         pairwise_block_kwargs: dict = dict(),
         pair_bias_attn_kwargs: dict = dict(),
+        checkpoint_layers: bool = False,
     ):
         super().__init__()
         layers = ModuleList([])
@@ -972,6 +1221,11 @@ class PairformerStack(Module):
 
         self.layers = layers
 
+        # recompute each layer's activations during the backward pass,
+        # rather than keeping the pairwise activations of every layer in memory
+
+        self.checkpoint_layers = checkpoint_layers
+
         # https://arxiv.org/abs/2405.16039 and https://arxiv.org/abs/2405.15071
         # although possibly recycling already takes care of this
 
@@ -990,6 +1244,35 @@ class PairformerStack(Module):
                 torch.zeros(num_register_tokens, dim_pairwise)
             )
 
+    @staticmethod
+    def _forward_layer(
+        layer: ModuleList,
+        single_repr: Float["b n ds"],  # type: ignore
+        pairwise_repr: Float["b n n dp"],  # type: ignore
+        mask: Bool["b n"] | None = None,  # type: ignore
+        pair_mask: Bool["b n n"] | None = None,  # type: ignore
+    ) -> Tuple[Float["b n ds"], Float["b n n dp"]]:  # type: ignore
+        """
+        Run a single Pairformer layer.
+
+        :param layer: The modules making up the Pairformer layer.
+        :param single_repr: The single representation tensor.
+        :param pairwise_repr: The pairwise representation tensor.
+        :param mask: The mask tensor.
+        :param pair_mask: The pairwise mask tensor.
+        :return: The updated single and pairwise representation tensors.
+        """
+        pairwise_block, pair_bias_attn, single_transition = layer
+
+        pairwise_repr = pairwise_block(pairwise_repr=pairwise_repr, mask=mask, pair_mask=pair_mask)
+
+        single_repr = (
+            pair_bias_attn(single_repr, pairwise_repr=pairwise_repr, mask=mask) + single_repr
+        )
+        single_repr = single_transition(single_repr) + single_repr
+
+        return single_repr, pairwise_repr
+
     @typecheck
     def forward(
         self,
@@ -1013,38 +1296,56 @@ class PairformerStack(Module):
                 single_repr.shape[0],
                 self.num_registers,
             )
-            single_registers = repeat(self.single_registers, "r d -> b r d", b=batch_size)
+            single_registers = self.single_registers.expand(batch_size, -1, -1)
             single_repr = torch.cat((single_registers, single_repr), dim=1)
 
-            row_registers = repeat(
-                self.pairwise_row_registers,
-                "r d -> b r n d",
-                b=batch_size,
-                n=pairwise_repr.shape[-2],
+            # write the registers and pairwise repr into one preallocated tensor,
+            # rather than concatenating rows then columns, which copies the pairwise repr twice
+
+            seq_len, dim_pairwise = pairwise_repr.shape[-2:]
+            padded_len = num_registers + seq_len
+
+            padded_pairwise_repr = pairwise_repr.new_empty(
+                (batch_size, padded_len, padded_len, dim_pairwise)
             )
-            pairwise_repr = torch.cat((row_registers, pairwise_repr), dim=1)
-            col_registers = repeat(
-                self.pairwise_col_registers,
-                "r d -> b n r d",
-                b=batch_size,
-                n=pairwise_repr.shape[1],
+            padded_pairwise_repr[:, :, :num_registers] = self.pairwise_col_registers
+            padded_pairwise_repr[:, :num_registers, num_registers:] = rearrange(
+                self.pairwise_row_registers, "r d -> r 1 d"
             )
-            pairwise_repr = torch.cat((col_registers, pairwise_repr), dim=2)
+            padded_pairwise_repr[:, num_registers:, num_registers:] = pairwise_repr
+
+            pairwise_repr = padded_pairwise_repr
 
             if exists(mask):
                 mask = F.pad(mask, (num_registers, 0), value=True)
 
         # main transformer block layers
 
-        for _ in range(self.recurrent_depth):
-            for pairwise_block, pair_bias_attn, single_transition in self.layers:
-                pairwise_repr = pairwise_block(pairwise_repr=pairwise_repr, mask=mask)
+        # the pairwise mask is derived once and shared by all layers
 
-                single_repr = (
-                    pair_bias_attn(single_repr, pairwise_repr=pairwise_repr, mask=mask)
-                    + single_repr
-                )
-                single_repr = single_transition(single_repr) + single_repr
+        pair_mask = None
+
+        if exists(mask):
+            pair_mask = mask[:, :, None] & mask[:, None, :]
+
+        should_checkpoint = self.checkpoint_layers and self.training and torch.is_grad_enabled()
+
+        for _ in range(self.recurrent_depth):
+            for layer in self.layers:
+                if should_checkpoint:
+                    single_repr, pairwise_repr = checkpoint(
+                        self._forward_layer,
+                        layer,
+                        single_repr,
+                        pairwise_repr,
+                        mask,
+                        pair_mask,
+                        use_reentrant=False,
+                    )
+                else:
+                    single_repr, pairwise_repr = self._forward_layer(
+                        layer, single_repr, pairwise_repr, mask, pair_mask
+                    )
 
         # splice out registers
 
@@ -1066,9 +1367,22 @@ class RelativePositionEncoding(Module):
         self.r_max = r_max
         self.s_max = s_max
 
-        dim_input = (2 * r_max + 2) + (2 * r_max + 2) + 1 + (2 * s_max + 2)
+        num_r_bins = 2 * r_max + 2
+        num_s_bins = 2 * s_max + 2
+
+        dim_input = num_r_bins + num_r_bins + 1 + num_s_bins
+        self.dim_input = dim_input
         self.out_embedder = LinearNoBias(dim_input, dim_out)
 
+        # offsets of the relative position, token and chain one-hots, as well as the
+        # same entity flag, within the concatenated input features
+
+        self.register_buffer(
+            "onehot_offsets", torch.tensor([0, num_r_bins, num_r_bins * 2 + 1]), persistent=False
+        )
+
+        self.same_entity_index = num_r_bins * 2
+
     @typecheck
     def forward(
         self, *, additional_molecule_feats: Int[f"b n {ADDITIONAL_MOLECULE_FEATS}"]  # type: ignore
@@ -1080,20 +1394,19 @@ class RelativePositionEncoding(Module):
         :return: The output tensor.
         """
 
-        device = additional_molecule_feats.device
         assert (
             additional_molecule_feats.shape[-1] >= 5
         ), "Additional molecule features must have at least 5 dimensions."
 
         res_idx, token_idx, asym_id, entity_id, sym_id = additional_molecule_feats.unbind(dim=-1)
 
-        diff_res_idx = einx.subtract("b i, b j -> b i j", res_idx, res_idx)
-        diff_token_idx = einx.subtract("b i, b j -> b i j", token_idx, token_idx)
-        diff_sym_id = einx.subtract("b i, b j -> b i j", sym_id, sym_id)
+        diff_res_idx = res_idx[:, :, None] - res_idx[:, None, :]
+        diff_token_idx = token_idx[:, :, None] - token_idx[:, None, :]
+        diff_sym_id = sym_id[:, :, None] - sym_id[:, None, :]
 
-        mask_same_chain = einx.subtract("b i, b j -> b i j", asym_id, asym_id) == 0
+        mask_same_chain = asym_id[:, :, None] == asym_id[:, None, :]
         mask_same_res = diff_res_idx == 0
-        mask_same_entity = einx.subtract("b i, b j -> b i j 1", entity_id, entity_id) == 0
+        mask_same_entity = entity_id[:, :, None] == entity_id[:, None, :]
 
         d_res = torch.where(
             mask_same_chain,
@@ -1113,20 +1426,14 @@ class RelativePositionEncoding(Module):
             2 * self.s_max + 1,
         )
 
-        def onehot(x, bins):
-            dist_from_bins = einx.subtract("... i, j -> ... i j", x, bins)
-            indices = dist_from_bins.abs().min(dim=-1, keepdim=True).indices
-            one_hots = F.one_hot(indices.long(), num_classes=len(bins))
-            return one_hots.float()
-
-        r_arange = torch.arange(2 * self.r_max + 2, device=device)
-        s_arange = torch.arange(2 * self.s_max + 2, device=device)
+        # the clipped distances are integers that already index their bins, so all three
+        # one-hots are scattered into a single preallocated feature tensor at their offsets
 
-        a_rel_pos = onehot(d_res, r_arange)
-        a_rel_token = onehot(d_token, r_arange)
-        a_rel_chain = onehot(d_chain, s_arange)
+        indices = torch.stack((d_res, d_token, d_chain), dim=-1).long() + self.onehot_offsets
 
-        out, _ = pack((a_rel_pos, a_rel_token, mask_same_entity, a_rel_chain), "b i j *")
+        out = torch.zeros((*indices.shape[:-1], self.dim_input), device=indices.device)
+        out.scatter_(-1, indices, 1.0)
+        out[..., self.same_entity_index] = mask_same_entity.float()
 
         return self.out_embedder(out)
 
@@ -1150,9 +1457,7 @@ class TemplateEmbedder(Module):
 
         self.template_feats_to_embed_input = LinearNoBias(dim_template_feats, dim)
 
-        self.pairwise_to_embed_input = nn.Sequential(
-            nn.LayerNorm(dim_pairwise), LinearNoBias(dim_pairwise, dim)
-        )
+        self.pairwise_to_embed_input = LayerNormLinearNoBias(dim_pairwise, dim)
 
         layers = ModuleList([])
         for _ in range(pairformer_stack_depth):
@@ -1170,6 +1475,20 @@ class TemplateEmbedder(Module):
 
         self.layerscale = nn.Parameter(torch.zeros(dim_pairwise)) if layerscale_output else 1.0
 
+    @typecheck
+    def embed_templates(
+        self,
+        templates: Float["b t n n dt"],  # type: ignore
+    ) -> Float["b t n n d"]:  # type: ignore
+        """
+        Project the template features, which does not depend on the pairwise representation,
+        such that it can be carried out once and reused across recycling steps.
+
+        :param templates: The templates tensor.
+        :return: The embedded templates tensor.
+        """
+        return self.template_feats_to_embed_input(templates)
+
     @typecheck
     def forward(
         self,
@@ -1178,6 +1497,7 @@ class TemplateEmbedder(Module):
         template_mask: Bool["b t"],  # type: ignore
         pairwise_repr: Float["b n n dp"],  # type: ignore
         mask: Bool["b n"] | None = None,  # type: ignore
+        embedded_templates: Float["b t n n d"] | None = None,  # type: ignore
     ) -> Float["b n n dp"]:  # type: ignore
         """
         Perform the forward pass.
@@ -1186,42 +1506,56 @@ class TemplateEmbedder(Module):
         :param template_mask: The template mask tensor.
         :param pairwise_repr: The pairwise representation tensor.
         :param mask: The mask tensor.
+        :param embedded_templates: The templates tensor, already embedded with `embed_templates`.
         :return: The output tensor.
         """
 
         num_templates = templates.shape[1]
 
+        if not exists(embedded_templates):
+            embedded_templates = self.embed_templates(templates)
+
         pairwise_repr = self.pairwise_to_embed_input(pairwise_repr)
         pairwise_repr = rearrange(pairwise_repr, "b i j d -> b 1 i j d")
 
-        v = self.template_feats_to_embed_input(templates) + pairwise_repr
+        v = embedded_templates + pairwise_repr
+
+        batch = v.shape[0]
+        v = v.flatten(0, 1)
+
+        has_templates = template_mask.any(dim=-1)
 
-        v, merged_batch_ps = pack_one(v, "* i j d")
+        # the mask is shared by all templates, so the pairwise mask is derived once for all
+        # blocks, and both are broadcast across the templates before being folded into the batch
 
-        has_templates = reduce(template_mask, "b t -> b", "any")
+        pair_mask = None
 
         if exists(mask):
-            mask = repeat(mask, "b n -> (b t) n", t=num_templates)
+            pair_mask = mask[:, :, None] & mask[:, None, :]
+
+            mask = mask[:, None].expand(-1, num_templates, -1).flatten(0, 1)
+            pair_mask = pair_mask[:, None].expand(-1, num_templates, -1, -1).flatten(0, 1)
 
         for block in self.pairformer_stack:
-            v = block(pairwise_repr=v, mask=mask) + v
+            v = block(pairwise_repr=v, mask=mask, pair_mask=pair_mask) + v
 
         u = self.final_norm(v)
 
-        u = unpack_one(u, merged_batch_ps, "* i jk d")
+        u = u.unflatten(0, (batch, num_templates))
 
         # masked mean pool template repr
+        # the masked sum over templates is a single contraction with the float template mask
 
-        u = einx.where("b t, b t ..., -> b t ...", template_mask, u, 0.0)
+        template_mask = template_mask.type(u.dtype)
 
-        num = reduce(u, "b t i j d -> b i j d", "sum")
-        den = reduce(template_mask.float(), "b t -> b", "sum")
+        num = einsum(template_mask, u, "b t, b t i j d -> b i j d")
+        den = template_mask.sum(dim=-1).clamp(min=self.eps)
 
-        avg_template_repr = einx.divide("b i j d, b -> b i j d", num, den.clamp(min=self.eps))
+        avg_template_repr = num / den[:, None, None, None]
 
         out = self.to_out(avg_template_repr)
 
-        out = einx.where("b, b ..., -> b ...", has_templates, out, 0.0)
+        out = torch.where(has_templates[:, None, None, None], out, 0.0)
 
         return out * self.layerscale
 
@@ -1249,8 +1583,11 @@ class FourierEmbedding(Module):
         :param times: The times tensor.
         :return: The output tensor.
         """
+        # the projection has a single input feature, so it is an elementwise multiply-add
+        # of the times with the frozen random frequencies, rather than a matmul
+
         times = rearrange(times, "b -> b 1")
-        rand_proj = self.proj(times)
+        rand_proj = torch.addcmul(self.proj.bias, times, self.proj.weight[:, 0])
         return torch.cos(2 * pi * rand_proj)
 
 
@@ -1513,9 +1850,13 @@ class DiffusionTransformer(Module):
         # register tokens
 
         if self.has_registers:
+            # the registers are broadcast over the batch rather than repeated, as the
+            # concatenation makes the only copy. the pairwise representation is padded once
+            # here for all layers, so each layer's pair bias projection sees the zero border
+
             num_registers = self.num_registers
-            registers = repeat(self.registers, "r d -> b r d", b=noised_repr.shape[0])
-            noised_repr, registers_ps = pack((registers, noised_repr), "b * d")
+            registers = self.registers.expand(noised_repr.shape[0], -1, -1)
+            noised_repr = torch.cat((registers, noised_repr), dim=1)
 
             single_repr = F.pad(single_repr, (0, 0, num_registers, 0), value=0.0)
             pairwise_repr = F.pad(
@@ -1559,12 +1900,12 @@ class DiffusionTransformer(Module):
             residual = noised_repr if self.add_residual else 0.0
 
             if not serial:
-                ff_out = ff_out + attn_out + residual
+                noised_repr = ff_out + attn_out + residual
 
         # splice out registers
 
         if self.has_registers:
-            _, noised_repr = unpack(noised_repr, registers_ps, "b * d")
+            noised_repr = noised_repr[:, self.num_registers :]
 
         return noised_repr
 
@@ -1661,9 +2002,11 @@ class DiffusionModule(Module):
             nn.LayerNorm(dim_single), LinearNoBias(dim_single, dim_atom)
         )
 
-        self.pairwise_repr_to_atompair_feat_cond = nn.Sequential(
-            nn.LayerNorm(dim_pairwise),
-            LinearNoBias(dim_pairwise, dim_atompair),
+        # the pairwise representation is projected down to the much narrower atompair dimension,
+        # so the layernorm is folded into the projection rather than materialized at full width
+
+        self.pairwise_repr_to_atompair_feat_cond = LayerNormLinearNoBias(
+            dim_pairwise, dim_atompair
         )
 
         self.atom_repr_to_atompair_feat_cond = nn.Sequential(
@@ -1672,11 +2015,14 @@ class DiffusionModule(Module):
             nn.ReLU(),
         )
 
+        # the relus act in place on the freshly projected hidden atompair features,
+        # so no extra intermediates the size of the windowed atompair tensor are kept around
+
         self.atompair_feats_mlp = nn.Sequential(
             LinearNoBias(dim_atompair, dim_atompair),
-            nn.ReLU(),
+            nn.ReLU(inplace=True),
             LinearNoBias(dim_atompair, dim_atompair),
-            nn.ReLU(),
+            nn.ReLU(inplace=True),
             LinearNoBias(dim_atompair, dim_atompair),
         )
 
@@ -1733,10 +2079,52 @@ class DiffusionModule(Module):
             **atom_decoder_kwargs,
         )
 
-        self.atom_feat_to_atom_pos_update = nn.Sequential(
-            nn.LayerNorm(dim_atom), LinearNoBias(dim_atom, 3)
+        self.atom_feat_to_atom_pos_update = LayerNormLinearNoBias(dim_atom, 3)
+
+    @typecheck
+    def get_atom_indices(
+        self,
+        molecule_atom_lens: Int["b n"],  # type: ignore
+        atom_seq_len: int,
+    ) -> Tuple[Int["b m"], Int["b nw w (w*2)"]]:  # type: ignore
+        """
+        Derive the indices used to broadcast token level features out to the atoms.
+
+        :param molecule_atom_lens: The molecule atom lengths tensor.
+        :param atom_seq_len: The atom sequence length.
+        :return: The index of the token each atom belongs to, and the flat index of the token
+            pair each windowed atom pair belongs to.
+        """
+        w = self.atoms_per_window
+        batch_size, seq_len, device = *molecule_atom_lens.shape, molecule_atom_lens.device
+
+        # the token each atom belongs to, found by searching the atom positions within the
+        # cumulative token lengths. atoms past the last token get `seq_len`, a zero sink token,
+        # so token level features are broadcast out to the atoms with a single gather
+
+        atom_positions = torch.arange(atom_seq_len, device=device)
+        atom_positions = repeat(atom_positions, "m -> b m", b=batch_size)
+
+        atom_token_indices = torch.searchsorted(
+            molecule_atom_lens.cumsum(dim=-1), atom_positions, right=True
         )
 
+        # the token pair of each windowed atom pair, as a single flat index into the
+        # pairwise representation with its token pair dimensions flattened
+
+        indices = atom_token_indices.masked_fill(atom_token_indices == seq_len, 0)
+        indices = pad_and_window(indices, w)
+
+        # the row and column indices broadcast against each other in forming the flat index,
+        # so neither is materialized at the full windowed pair shape
+
+        row_indices = rearrange(indices, "b n w -> b n w 1")
+        col_indices = concat_previous_window(indices, dim_seq=1, dim_window=-1)
+
+        atompair_token_pair_indices = row_indices * seq_len + col_indices[..., None, :]
+
+        return atom_token_indices, atompair_token_pair_indices
+
     @typecheck
     def forward(
         self,
@@ -1753,6 +2141,7 @@ class DiffusionModule(Module):
         pairwise_rel_pos_feats: Float["b n n dpr"],  # type: ignore
         molecule_atom_lens: Int["b n"],  # type: ignore
         atom_parent_ids: Int["b m"] | None = None,  # type: ignore
+        atom_indices: Tuple[Int["b m"], Int["b nw w (w*2)"]] | None = None,  # type: ignore
     ) -> Float["b m 3"]:  # type: ignore
         """
         Perform the forward pass.
@@ -1768,12 +2157,12 @@ class DiffusionModule(Module):
         :param pairwise_trunk: The pairwise trunk tensor.
         :param pairwise_rel_pos_feats: The pairwise relative position features tensor.
         :param molecule_atom_lens: The molecule atom lengths tensor.
+        :param atom_parent_ids: The atom parent IDs tensor.
+        :param atom_indices: The precomputed output of `get_atom_indices`.
         :return: The output tensor.
         """
         w = self.atoms_per_window
-        device = noised_atom_pos.device
 
-        batch_size, seq_len = single_trunk_repr.shape[:2]
         atom_seq_len = atom_feats.shape[1]
 
         conditioned_single_repr = self.single_conditioner(
@@ -1795,14 +2184,23 @@ class DiffusionModule(Module):
 
         atom_feats = self.atom_pos_to_atom_feat(noised_atom_pos) + atom_feats
 
+        # the atom indexing only depends on the molecule atom lengths, so it can be passed in
+        # precomputed when the network is called repeatedly, as it is when sampling
+
+        if not exists(atom_indices):
+            atom_indices = self.get_atom_indices(molecule_atom_lens, atom_seq_len)
+
+        atom_token_indices, atompair_token_pair_indices = atom_indices
+
+        def tokens_to_atoms(t: Float["b n d"]) -> Float["b m d"]:  # type: ignore
+            t = F.pad(t, (0, 0, 0, 1), value=0.0)
+            return t.gather(1, atom_token_indices[..., None].expand(-1, -1, t.shape[-1]))
+
         # condition atom feats cond (cl) with single repr
 
         single_repr_cond = self.single_repr_to_atom_feat_cond(conditioned_single_repr)
 
-        single_repr_cond = repeat_consecutive_with_lens(single_repr_cond, molecule_atom_lens)
-        single_repr_cond = pad_or_slice_to(
-            single_repr_cond, length=atom_feats_cond.shape[1], dim=1
-        )
+        single_repr_cond = tokens_to_atoms(single_repr_cond)
 
         atom_feats_cond = single_repr_cond + atom_feats_cond
 
@@ -1819,25 +2217,13 @@ class DiffusionModule(Module):
 
         pairwise_repr_cond = self.pairwise_repr_to_atompair_feat_cond(conditioned_pairwise_repr)
 
-        indices = torch.arange(seq_len, device=device)
-        indices = repeat(indices, "n -> b n", b=batch_size)
-
-        indices = repeat_consecutive_with_lens(indices, molecule_atom_lens)
-        indices = pad_or_slice_to(indices, atom_seq_len, dim=-1)
-        indices = pad_and_window(indices, w)
-
-        row_indices = col_indices = indices
-        row_indices = rearrange(row_indices, "b n w -> b n w 1", w=w)
-        col_indices = rearrange(col_indices, "b n w -> b n 1 w", w=w)
+        dim_atompair = pairwise_repr_cond.shape[-1]
 
-        col_indices = concat_previous_window(col_indices, dim_seq=1, dim_window=-1)
-        row_indices, col_indices = torch.broadcast_tensors(row_indices, col_indices)
-
-        pairwise_repr_cond = einx.get_at(
-            "b [i j] dap, b nw w1 w2, b nw w1 w2 -> b nw w1 w2 dap",
-            pairwise_repr_cond,
-            row_indices,
-            col_indices,
+        pairwise_repr_cond = pairwise_repr_cond.flatten(1, 2).gather(
+            1, atompair_token_pair_indices.flatten(1)[..., None].expand(-1, -1, dim_atompair)
+        )
+        pairwise_repr_cond = pairwise_repr_cond.reshape(
+            *atompair_token_pair_indices.shape, dim_atompair
         )
 
         atompair_feats = pairwise_repr_cond + atompair_feats
@@ -1851,11 +2237,10 @@ class DiffusionModule(Module):
 
         atom_repr_cond_col = concat_previous_window(atom_repr_cond_col, dim_seq=1, dim_window=2)
 
-        atompair_feats = einx.add(
-            "b nw w1 w2 dap, b nw w1 dap -> b nw w1 w2 dap", atompair_feats, atom_repr_cond_row
-        )
-        atompair_feats = einx.add(
-            "b nw w1 w2 dap, b nw w2 dap -> b nw w1 w2 dap", atompair_feats, atom_repr_cond_col
+        atompair_feats = (
+            atompair_feats
+            + atom_repr_cond_row[:, :, :, None, :]
+            + atom_repr_cond_col[:, :, None, :, :]
         )
 
         # furthermore, they did one more MLP on the atompair feats for attention biasing in atom transformer
@@ -1872,8 +2257,8 @@ class DiffusionModule(Module):
                 atom_parent_ids_rows, dim_seq=1, dim_window=2
             )
 
-            windowed_mask = einx.equal(
-                "b n i, b n j -> b n i j", atom_parent_ids_rows, atom_parent_ids_columns
+            windowed_mask = (
+                atom_parent_ids_rows[..., :, None] == atom_parent_ids_columns[..., None, :]
             )
 
         # atom encoder
@@ -1911,10 +2296,7 @@ class DiffusionModule(Module):
 
         atom_decoder_input = self.tokens_to_atom_decoder_input_cond(tokens)
 
-        atom_decoder_input = repeat_consecutive_with_lens(atom_decoder_input, molecule_atom_lens)
-        atom_decoder_input = pad_or_slice_to(
-            atom_decoder_input, length=atom_feats_skip.shape[1], dim=1
-        )
+        atom_decoder_input = tokens_to_atoms(atom_decoder_input)
 
         atom_decoder_input = atom_decoder_input + atom_feats_skip
 
@@ -1972,12 +2354,32 @@ class ElucidatedAtomDiffusion(Module):
         S_tmin=0.05,
         S_tmax=50,
         S_noise=1.003,
+        skip_corrector_sigma_threshold=0.0,  # no second order correction at or below this sigma
         smooth_lddt_loss_kwargs: dict = dict(),
         weighted_rigid_align_kwargs: dict = dict(),
+        enable_bf16_autocast=False,
+        enable_bf16_sampling_autocast=False,
+        compile_net=False,
+        compile_net_kwargs: dict = dict(mode="reduce-overhead", dynamic=False),
     ):
         super().__init__()
         self.net = net
 
+        # optionally compile the forward of the denoising network once, to be reused across
+        # all of the network evaluations of the sampling loop - kept as a plain callable,
+        # so that the parameters of the network are not registered a second time
+
+        self.compiled_net_forward = (
+            torch.compile(net.forward, **compile_net_kwargs) if compile_net else None
+        )
+
+        # optionally run the denoising network in bfloat16, while the preconditioning
+        # and the update of the atom positions stay in float32 - either always, or only
+        # for the network evaluations of the sampling loop
+
+        self.enable_bf16_autocast = enable_bf16_autocast
+        self.enable_bf16_sampling_autocast = enable_bf16_sampling_autocast
+
         # parameters
 
         self.sigma_min = sigma_min
@@ -1996,6 +2398,8 @@ class ElucidatedAtomDiffusion(Module):
         self.S_tmax = S_tmax
         self.S_noise = S_noise
 
+        self.skip_corrector_sigma_threshold = skip_corrector_sigma_threshold
+
         # weighted rigid align
 
         self.weighted_rigid_align = WeightedRigidAlign(**weighted_rigid_align_kwargs)
@@ -2062,6 +2466,7 @@ class ElucidatedAtomDiffusion(Module):
         sigma: Float[" b"] | Float[" "] | float,  # type: ignore
         network_condition_kwargs: dict,
         clamp=False,
+        sampling=False,
     ):
         """
         Run a network forward pass, with the preconditioned inputs.
@@ -2070,6 +2475,8 @@ class ElucidatedAtomDiffusion(Module):
         :param sigma: The sigma value.
         :param network_condition_kwargs: The network condition keyword arguments.
         :param clamp: Whether to clamp the output.
+        :param sampling: Whether the network is run within the sampling loop, in which case the
+            compiled network forward and the sampling autocast are used, if enabled.
         :return: The output tensor.
         """
         batch, device = noised_atom_pos.shape[0], noised_atom_pos.device
@@ -2079,11 +2486,23 @@ class ElucidatedAtomDiffusion(Module):
 
         padded_sigma = rearrange(sigma, "b -> b 1 1")
 
-        net_out = self.net(
-            self.c_in(padded_sigma) * noised_atom_pos,
-            times=self.c_noise(sigma),
-            **network_condition_kwargs,
-        )
+        net = self.net
+
+        if sampling and exists(self.compiled_net_forward):
+            net = self.compiled_net_forward
+
+        with torch.autocast(
+            device_type=device.type,
+            dtype=torch.bfloat16,
+            enabled=self.enable_bf16_autocast or (sampling and self.enable_bf16_sampling_autocast),
+        ):
+            net_out = net(
+                self.c_in(padded_sigma) * noised_atom_pos,
+                times=self.c_noise(sigma),
+                **network_condition_kwargs,
+            )
+
+        net_out = net_out.type(noised_atom_pos.dtype)
 
         out = self.c_skip(padded_sigma) * noised_atom_pos + self.c_out(padded_sigma) * net_out
 
@@ -2097,28 +2516,31 @@ class ElucidatedAtomDiffusion(Module):
     # sample schedule
     # equation (7) in the paper
 
-    def sample_schedule(self, num_sample_steps=None):
+    def sample_schedule(self, num_sample_steps=None, device=None):
         """
         Return the schedule of sigmas for sampling.
         Algorithm (7) in the paper.
 
         :param num_sample_steps: The number of sample steps.
+        :param device: The device of the schedule, defaulting to the device of the module.
         :return: The schedule of sigmas for sampling.
         """
         num_sample_steps = default(num_sample_steps, self.num_sample_steps)
+        device = default(device, self.device)
 
         N = num_sample_steps
         inv_rho = 1 / self.rho
 
         # NOTE: this differs in notation from the paper slightly
-        steps = torch.arange(num_sample_steps, device=self.device, dtype=torch.float32)
+        # the schedule is small, so it is built on the host in double precision and moved once
+        steps = torch.arange(num_sample_steps, dtype=torch.float64)
         sigmas = (
             self.sigma_max**inv_rho
             + steps / (N - 1) * (self.sigma_min**inv_rho - self.sigma_max**inv_rho)
         ) ** self.rho
 
         sigmas = F.pad(sigmas, (0, 1), value=0.0)  # last step is sigma value of 0.
-        return sigmas
+        return sigmas.to(device=device, dtype=torch.float32)
 
     @torch.no_grad()
     def sample(self, atom_mask: Bool["b m"] | None = None, num_sample_steps=None, clamp=False, use_tqdm_pbar=True, tqdm_pbar_title="Sampling time step", **network_condition_kwargs):  # type: ignore
@@ -2139,9 +2561,21 @@ class ElucidatedAtomDiffusion(Module):
 
         network_condition_kwargs.update(atom_mask=atom_mask)
 
+        # the atom indexing of the network only depends on the molecule atom lengths,
+        # so derive it once for all of the sampling steps
+
+        if "atom_indices" not in network_condition_kwargs:
+            network_condition_kwargs.update(
+                atom_indices=self.net.get_atom_indices(
+                    network_condition_kwargs["molecule_atom_lens"], atom_mask.shape[-1]
+                )
+            )
+
         # get the schedule, which is returned as (sigma, gamma) tuple, and pair up with the next sigma and gamma
 
-        sigmas = self.sample_schedule(num_sample_steps)
+        # the schedule is only consumed as python floats, so it stays on the host
+
+        sigmas = self.sample_schedule(num_sample_steps, device=torch.device("cpu"))
 
         gammas = torch.where(
             (sigmas >= self.S_tmin) & (sigmas <= self.S_tmax),
@@ -2149,7 +2583,9 @@ class ElucidatedAtomDiffusion(Module):
             0.0,
         )
 
-        sigmas_and_gammas = list(zip(sigmas[:-1], sigmas[1:], gammas[:-1]))
+        sigmas, gammas = sigmas.tolist(), gammas.tolist()
+
+        sigmas_and_gammas = zip(sigmas[:-1], sigmas[1:], gammas[:-1])
 
         # atom position is noise at the beginning
 
@@ -2157,16 +2593,17 @@ class ElucidatedAtomDiffusion(Module):
 
         atom_pos = init_sigma * torch.randn(shape, device=self.device)
 
+        # the noise for the stochastic sampling of all steps is drawn at once
+
+        all_eps = self.S_noise * torch.randn((num_sample_steps, *shape), device=self.device)
+
         # gradually denoise
 
         maybe_tqdm_wrapper = tqdm if use_tqdm_pbar else identity
 
-        for sigma, sigma_next, gamma in maybe_tqdm_wrapper(
-            sigmas_and_gammas, desc=tqdm_pbar_title
+        for (sigma, sigma_next, gamma), eps in maybe_tqdm_wrapper(
+            zip(sigmas_and_gammas, all_eps), desc=tqdm_pbar_title, total=num_sample_steps
         ):
-            sigma, sigma_next, gamma = map(lambda t: t.item(), (sigma, sigma_next, gamma))
-
-            eps = self.S_noise * torch.randn(shape, device=self.device)  # stochastic sampling
 
             sigma_hat = sigma + gamma * sigma
             atom_pos_hat = atom_pos + sqrt(sigma_hat**2 - sigma**2) * eps
@@ -2176,22 +2613,26 @@ class ElucidatedAtomDiffusion(Module):
                 sigma_hat,
                 clamp=clamp,
                 network_condition_kwargs=network_condition_kwargs,
+                sampling=True,
             )
             denoised_over_sigma = (atom_pos_hat - model_output) / sigma_hat
 
-            atom_pos_next = atom_pos_hat + (sigma_next - sigma_hat) * denoised_over_sigma
+            sigma_delta = sigma_next - sigma_hat
 
-            # second order correction, if not the last timestep
+            atom_pos_next = atom_pos_hat + sigma_delta * denoised_over_sigma
 
-            if sigma_next != 0:
+            # second order correction, if not the last timestep (or a near terminal one)
+
+            if sigma_next > self.skip_corrector_sigma_threshold:
                 model_output_next = self.preconditioned_network_forward(
                     atom_pos_next,
                     sigma_next,
                     clamp=clamp,
                     network_condition_kwargs=network_condition_kwargs,
+                    sampling=True,
                 )
                 denoised_prime_over_sigma = (atom_pos_next - model_output_next) / sigma_next
-                atom_pos_next = atom_pos_hat + 0.5 * (sigma_next - sigma_hat) * (
+                atom_pos_next = atom_pos_hat + 0.5 * sigma_delta * (
                     denoised_over_sigma + denoised_prime_over_sigma
                 )
 
@@ -2305,29 +2746,26 @@ class ElucidatedAtomDiffusion(Module):
         align_weights = atom_pos_ground_truth.new_ones(atom_pos_ground_truth.shape[:2])
 
         if exists(is_molecule_types):
-            is_nucleotide_or_ligand_fields = is_molecule_types.unbind(dim=-1)
+            # repeat all of the molecule type fields out to the atoms at once
 
-            is_nucleotide_or_ligand_fields = tuple(
-                repeat_consecutive_with_lens(t, molecule_atom_lens)
-                for t in is_nucleotide_or_ligand_fields
+            atom_is_molecule_types = repeat_consecutive_with_lens(
+                is_molecule_types, molecule_atom_lens
             )
-            is_nucleotide_or_ligand_fields = tuple(
-                pad_or_slice_to(t, length=align_weights.shape[-1], dim=-1)
-                for t in is_nucleotide_or_ligand_fields
+            atom_is_molecule_types = pad_or_slice_to(
+                atom_is_molecule_types, length=align_weights.shape[-1], dim=1
             )
 
-            _, atom_is_dna, atom_is_rna, atom_is_ligand = is_nucleotide_or_ligand_fields
+            _, atom_is_dna, atom_is_rna, atom_is_ligand = atom_is_molecule_types.unbind(dim=-1)
 
             # section 3.7.1 equation 4
 
             # upweighting of nucleotide and ligand atoms is additive per equation 4
 
-            align_weights = torch.where(
-                atom_is_dna | atom_is_rna,
-                1 + nucleotide_loss_weight,
-                align_weights,
+            align_weights = (
+                align_weights
+                + nucleotide_loss_weight * (atom_is_dna | atom_is_rna).type(align_weights.dtype)
+                + ligand_loss_weight * atom_is_ligand.type(align_weights.dtype)
             )
-            align_weights = torch.where(atom_is_ligand, 1 + ligand_loss_weight, align_weights)
 
         # section 3.7.1 equation 2 - weighted rigid aligned ground truth
 
@@ -2345,20 +2783,20 @@ class ElucidatedAtomDiffusion(Module):
                 denoised_atom_pos,
                 atom_pos_aligned_ground_truth,
                 reduction="none",
-            )
+            ).sum(dim=-1)
             / 3.0
         )
-        losses = einx.multiply("b m c, b m -> b m c", losses, align_weights)
 
         # regular loss weight as defined in EDM paper
 
         loss_weights = self.loss_weight(padded_sigmas)
 
-        losses = losses * loss_weights
+        # account for atom mask, folding it and both weightings into a single weighted sum
+        # over the atoms, rather than gathering the unmasked losses
 
-        # account for atom mask
+        atom_weights = align_weights * loss_weights[..., 0] * atom_mask
 
-        mse_loss = losses[atom_mask].mean()
+        mse_loss = (losses * atom_weights).sum() / (atom_mask.sum() * 3)
 
         total_loss = total_loss + mse_loss
 
@@ -2367,15 +2805,23 @@ class ElucidatedAtomDiffusion(Module):
         bond_loss = self.zero
 
         if add_bond_loss:
-            atompair_mask = einx.logical_and("b i, b j -> b i j", atom_mask, atom_mask)
-
             denoised_cdist = torch.cdist(denoised_atom_pos, denoised_atom_pos, p=2)
             normalized_cdist = torch.cdist(atom_pos_ground_truth, atom_pos_ground_truth, p=2)
 
             bond_losses = F.mse_loss(denoised_cdist, normalized_cdist, reduction="none")
-            bond_losses = bond_losses * loss_weights
 
-            bond_loss = bond_losses[atompair_mask].mean()
+            # reduce over the pairs of atoms with the outer product of the atom mask folded
+            # into the contraction, rather than materializing and indexing with a pairwise mask
+
+            atom_mask_float = atom_mask.type(bond_losses.dtype)
+
+            bond_losses = einsum(
+                atom_mask_float, bond_losses, atom_mask_float, "b i, b i j, b j -> b"
+            )
+
+            num_atompairs = atom_mask_float.sum(dim=-1).square().sum()
+
+            bond_loss = (bond_losses * loss_weights.flatten()).sum() / num_atompairs
 
             total_loss = total_loss + bond_loss
 
@@ -2408,15 +2854,52 @@ class ElucidatedAtomDiffusion(Module):
 # modules
 
 
+def smooth_lddt_sum(dist_diff: Tensor, mask: Tensor) -> Tensor:
+    """
+    Sum the smooth LDDT scores (i.e., the average of the four sigmoid-relaxed distance
+    thresholds) over the masked pairs of atoms.
+
+    :param dist_diff: The absolute distance differences between all pairs of atoms.
+    :param mask: The mask of the pairs of atoms to score.
+    :return: The summed scores for each batch element.
+    """
+    eps = (
+        F.sigmoid(0.5 - dist_diff)
+        + F.sigmoid(1.0 - dist_diff)
+        + F.sigmoid(2.0 - dist_diff)
+        + F.sigmoid(4.0 - dist_diff)
+    ) / 4.0
+
+    return (eps * mask).sum(dim=(-1, -2))
+
+
 class SmoothLDDTLoss(Module):
     """Algorithm 27."""
 
     @typecheck
-    def __init__(self, nucleic_acid_cutoff: float = 30.0, other_cutoff: float = 15.0):
+    def __init__(
+        self,
+        nucleic_acid_cutoff: float = 30.0,
+        other_cutoff: float = 15.0,
+        compile_lddt_sum: bool = False,
+        block_size: int | None = None,
+    ):
         super().__init__()
         self.nucleic_acid_cutoff = nucleic_acid_cutoff
         self.other_cutoff = other_cutoff
 
+        # optionally compute the loss over blocks of atoms, to bound the memory of the
+        # pairwise distances for large numbers of atoms
+
+        self.block_size = block_size
+
+        # optionally fuse the sigmoid ladder and the masked sum over all pairs of atoms
+        # into a single kernel, rather than materializing each of the intermediates
+
+        self.lddt_sum = (
+            torch.compile(smooth_lddt_sum, dynamic=True) if compile_lddt_sum else smooth_lddt_sum
+        )
+
     @typecheck
     def forward(
         self,
@@ -2436,44 +2919,46 @@ class SmoothLDDTLoss(Module):
         :param coords_mask: The coordinates mask.
         :return: The output tensor.
         """
-        # Compute distances between all pairs of atoms
-        pred_dists = torch.cdist(pred_coords, pred_coords)
-        true_dists = torch.cdist(true_coords, true_coords)
+        num_atoms, device = pred_coords.shape[1], pred_coords.device
+        block_size = default(self.block_size, num_atoms)
+
+        is_nucleotide = is_dna | is_rna
+        atom_indices = torch.arange(num_atoms, device=device)
 
-        # Compute distance difference for all pairs of atoms
-        dist_diff = torch.abs(true_dists - pred_dists)
+        # Accumulate over blocks of rows, such that only a block of the pairwise
+        # distances is materialized at any given time
+        lddt_sum = lddt_count = 0.0
 
-        # Compute epsilon values
-        eps = (
-            F.sigmoid(0.5 - dist_diff)
-            + F.sigmoid(1.0 - dist_diff)
-            + F.sigmoid(2.0 - dist_diff)
-            + F.sigmoid(4.0 - dist_diff)
-        ) / 4.0
+        for start in range(0, num_atoms, block_size):
+            rows = slice(start, start + block_size)
 
-        # Restrict to bespoke inclusion radius
-        is_nucleotide = is_dna | is_rna
-        is_nucleotide_pair = einx.logical_and("b i, b j -> b i j", is_nucleotide, is_nucleotide)
+            # Compute distances between the block of atoms and all atoms
+            pred_dists = torch.cdist(pred_coords[:, rows], pred_coords)
+            true_dists = torch.cdist(true_coords[:, rows], true_coords)
 
-        inclusion_radius = torch.where(
-            is_nucleotide_pair,
-            true_dists < self.nucleic_acid_cutoff,
-            true_dists < self.other_cutoff,
-        )
+            # Compute distance difference for all pairs of atoms
+            dist_diff = torch.abs(true_dists - pred_dists)
 
-        # Compute mean, avoiding self term
-        mask = inclusion_radius & ~torch.eye(
-            pred_coords.shape[1], dtype=torch.bool, device=pred_coords.device
-        )
+            # Restrict to bespoke inclusion radius
+            is_nucleotide_pair = is_nucleotide[:, rows, None] & is_nucleotide[:, None, :]
+
+            inclusion_radius = torch.where(
+                is_nucleotide_pair,
+                true_dists < self.nucleic_acid_cutoff,
+                true_dists < self.other_cutoff,
+            )
+
+            # Compute mean, avoiding self term
+            mask = inclusion_radius & (atom_indices[rows, None] != atom_indices)
 
-        # Take into account variable lengthed atoms in batch
-        if exists(coords_mask):
-            paired_coords_mask = einx.logical_and("b i, b j -> b i j", coords_mask, coords_mask)
-            mask = mask & paired_coords_mask
+            # Take into account variable lengthed atoms in batch
+            if exists(coords_mask):
+                mask = mask & coords_mask[:, rows, None] & coords_mask[:, None, :]
+
+            # Calculate masked averaging
+            lddt_sum = lddt_sum + self.lddt_sum(dist_diff, mask)
+            lddt_count = lddt_count + mask.sum(dim=(-1, -2))
 
-        # Calculate masked averaging
-        lddt_sum = (eps * mask).sum(dim=(-1, -2))
-        lddt_count = mask.sum(dim=(-1, -2))
         lddt = lddt_sum / lddt_count.clamp(min=1)
 
         return 1.0 - lddt.mean()
@@ -2482,6 +2967,82 @@ class SmoothLDDTLoss(Module):
 class WeightedRigidAlign(Module):
     """Algorithm 28."""
 
+    def __init__(self, use_quaternion_kabsch: bool = False):
+        super().__init__()
+
+        # optionally solve for the optimal rotation through the top eigenvector of the 4x4
+        # symmetric quaternion (Davenport) matrix, which always yields a proper rotation,
+        # rather than through an SVD of the covariance matrix followed by a reflection fix
+
+        self.use_quaternion_kabsch = use_quaternion_kabsch
+
+    @staticmethod
+    @typecheck
+    def quaternion_kabsch(
+        cov_matrix: Float["b 3 3"],  # type: ignore
+    ) -> Tuple[Float["b 3 3"], Float[" b"]]:  # type: ignore
+        """
+        Compute the optimal rotation matrix from the covariance matrix, using Horn's method.
+
+        :param cov_matrix: The covariance matrix between the true and predicted coordinates.
+        :return: The rotation matrix and the gap between the top two eigenvalues of the quaternion
+            matrix, with a vanishing gap denoting an ambiguous rotation.
+        """
+        # the covariance matrix is transposed relative to the (predicted, true) ordering of Horn
+
+        sxx, syx, szx, sxy, syy, szy, sxz, syz, szz = rearrange(
+            cov_matrix, "b i j -> b (i j)"
+        ).unbind(dim=-1)
+
+        davenport = torch.stack(
+            (
+                sxx + syy + szz,
+                syz - szy,
+                szx - sxz,
+                sxy - syx,
+                syz - szy,
+                sxx - syy - szz,
+                sxy + syx,
+                szx + sxz,
+                szx - sxz,
+                sxy + syx,
+                -sxx + syy - szz,
+                syz + szy,
+                sxy - syx,
+                szx + sxz,
+                syz + szy,
+                -sxx - syy + szz,
+            ),
+            dim=-1,
+        )
+
+        davenport = rearrange(davenport, "b (i j) -> b i j", i=4, j=4)
+
+        # the optimal rotation is given by the eigenvector of the largest eigenvalue
+
+        eigenvalues, eigenvectors = torch.linalg.eigh(davenport)
+        w, x, y, z = eigenvectors[..., -1].unbind(dim=-1)
+
+        rot_matrix = torch.stack(
+            (
+                1.0 - 2.0 * (y**2 + z**2),
+                2.0 * (x * y - w * z),
+                2.0 * (x * z + w * y),
+                2.0 * (x * y + w * z),
+                1.0 - 2.0 * (x**2 + z**2),
+                2.0 * (y * z - w * x),
+                2.0 * (x * z - w * y),
+                2.0 * (y * z + w * x),
+                1.0 - 2.0 * (x**2 + y**2),
+            ),
+            dim=-1,
+        )
+
+        rot_matrix = rearrange(rot_matrix, "b (i j) -> b i j", i=3, j=3)
+
+        return rot_matrix, eigenvalues[..., -1] - eigenvalues[..., -2]
+
+    @torch.no_grad()
     @typecheck
     def forward(
         self,
@@ -2504,22 +3065,23 @@ class WeightedRigidAlign(Module):
         """
         batch_size, num_points, dim = pred_coords.shape
 
+        # Concatenate the predicted and true coordinates, so that both are masked
+        # and reduced to their weighted centroids together
+        coords = torch.cat((pred_coords, true_coords), dim=-1)
+
         if exists(mask):
             # zero out all predicted and true coordinates where not an atom
-            pred_coords = einx.where("b n, b n c, -> b n c", mask, pred_coords, 0.0)
-            true_coords = einx.where("b n, b n c, -> b n c", mask, true_coords, 0.0)
-            weights = einx.where("b n, b n, -> b n", mask, weights, 0.0)
+            coords = torch.where(mask[..., None], coords, 0.0)
+            weights = weights * mask
 
         # Take care of weights broadcasting for coordinate dimension
         weights = rearrange(weights, "b n -> b n 1")
 
         # Compute weighted centroids
-        pred_centroid = (pred_coords * weights).sum(dim=1, keepdim=True) / weights.sum(
-            dim=1, keepdim=True
-        )
-        true_centroid = (true_coords * weights).sum(dim=1, keepdim=True) / weights.sum(
-            dim=1, keepdim=True
-        )
+        centroids = (coords * weights).sum(dim=1, keepdim=True) / weights.sum(dim=1, keepdim=True)
+
+        pred_coords, true_coords = coords.split(dim, dim=-1)
+        pred_centroid, true_centroid = centroids.split(dim, dim=-1)
 
         # Center the coordinates
         pred_coords_centered = pred_coords - pred_centroid
@@ -2538,32 +3100,46 @@ class WeightedRigidAlign(Module):
             "b n i, b n j -> b i j",
         )
 
-        # Compute the SVD of the covariance matrix
-        U, S, V = torch.svd(cov_matrix)
+        if self.use_quaternion_kabsch:
+            rot_matrix, eigengap = self.quaternion_kabsch(cov_matrix)
 
-        # Catch ambiguous rotation by checking the magnitude of singular values
-        if (S.abs() <= 1e-15).any() and not (num_points < (dim + 1)):
-            logger.warning(
-                "Excessively low rank of "
-                + "cross-correlation between aligned point clouds. "
-                + "`WeightedRigidAlign` cannot return a unique rotation."
+            # Catch ambiguous rotation by checking the gap between the top eigenvalues
+            if (eigengap.abs() <= 1e-15).any() and not (num_points < (dim + 1)):
+                logger.warning(
+                    "Excessively low rank of "
+                    + "cross-correlation between aligned point clouds. "
+                    + "`WeightedRigidAlign` cannot return a unique rotation."
+                )
+        else:
+            # Compute the SVD of the covariance matrix, using the Jacobi solver for the
+            # batch of small matrices on the GPU
+            U, S, Vh = torch.linalg.svd(
+                cov_matrix,
+                full_matrices=False,
+                driver="gesvdj" if cov_matrix.is_cuda else None,
             )
 
-        # Compute the rotation matrix
-        rot_matrix = einsum(U, V, "b i j, b k j -> b i k")
+            # Catch ambiguous rotation by checking the magnitude of singular values
+            if (S.abs() <= 1e-15).any() and not (num_points < (dim + 1)):
+                logger.warning(
+                    "Excessively low rank of "
+                    + "cross-correlation between aligned point clouds. "
+                    + "`WeightedRigidAlign` cannot return a unique rotation."
+                )
+
+            # Compute the rotation matrix
+            rot_matrix = U @ Vh
 
-        # Ensure proper rotation matrix with determinant 1
-        F = torch.eye(dim, dtype=cov_matrix.dtype, device=cov_matrix.device)[None].repeat(
-            batch_size, 1, 1
-        )
-        F[:, -1, -1] = torch.det(rot_matrix)
-        rot_matrix = einsum(U, F, V, "b i j, b j k, b l k -> b i l")
+            # Ensure proper rotation matrix with determinant 1, by flipping the sign of
+            # the last singular vector of U if the rotation is a reflection
+            F = torch.ones((batch_size, dim), dtype=cov_matrix.dtype, device=cov_matrix.device)
+            F[:, -1] = torch.det(rot_matrix)
+            rot_matrix = (U * rearrange(F, "b j -> b 1 j")) @ Vh
 
         # Apply the rotation and translation
         aligned_coords = (
             einsum(pred_coords_centered, rot_matrix, "b n i, b j i -> b n j") + true_centroid
         )
-        aligned_coords.detach_()
 
         return aligned_coords
 
@@ -2604,16 +3180,10 @@ class ExpressCoordinatesInFrame(Module):
         e2 = F.normalize(w2 - w1, dim=-1, eps=self.eps)
         e3 = torch.cross(e1, e2, dim=-1)
 
-        # Project onto frame basis
+        # Project onto frame basis, with the basis vectors as the rows of a single matrix
         d = coords - b
-        transformed_coords = torch.stack(
-            [
-                einsum(d, e1, "... i, ... i -> ..."),
-                einsum(d, e2, "... i, ... i -> ..."),
-                einsum(d, e3, "... i, ... i -> ..."),
-            ],
-            dim=-1,
-        )
+        basis = torch.stack((e1, e2, e3), dim=-2)
+        transformed_coords = einsum(d, basis, "... i, ... j i -> ... j")
 
         return transformed_coords
 
@@ -2722,30 +3292,25 @@ class CentreRandomAugmentation(Module):
         cos_angles = torch.cos(angles)
 
         # Construct rotation matrix
-        eye = torch.eye(3, device=self.device)
-        rotation_matrix = repeat(eye, "i j -> b i j", b=batch_size).clone()
+        s0, s1, s2 = sin_angles.unbind(dim=-1)
+        c0, c1, c2 = cos_angles.unbind(dim=-1)
 
-        rotation_matrix[:, 0, 0] = cos_angles[:, 0] * cos_angles[:, 1]
-        rotation_matrix[:, 0, 1] = (
-            cos_angles[:, 0] * sin_angles[:, 1] * sin_angles[:, 2]
-            - sin_angles[:, 0] * cos_angles[:, 2]
-        )
-        rotation_matrix[:, 0, 2] = (
-            cos_angles[:, 0] * sin_angles[:, 1] * cos_angles[:, 2]
-            + sin_angles[:, 0] * sin_angles[:, 2]
-        )
-        rotation_matrix[:, 1, 0] = sin_angles[:, 0] * cos_angles[:, 1]
-        rotation_matrix[:, 1, 1] = (
-            sin_angles[:, 0] * sin_angles[:, 1] * sin_angles[:, 2]
-            + cos_angles[:, 0] * cos_angles[:, 2]
-        )
-        rotation_matrix[:, 1, 2] = (
-            sin_angles[:, 0] * sin_angles[:, 1] * cos_angles[:, 2]
-            - cos_angles[:, 0] * sin_angles[:, 2]
+        rotation_matrix = torch.stack(
+            (
+                c0 * c1,
+                c0 * s1 * s2 - s0 * c2,
+                c0 * s1 * c2 + s0 * s2,
+                s0 * c1,
+                s0 * s1 * s2 + c0 * c2,
+                s0 * s1 * c2 - c0 * s2,
+                -s1,
+                c1 * s2,
+                c1 * c2,
+            ),
+            dim=-1,
         )
-        rotation_matrix[:, 2, 0] = -sin_angles[:, 1]
-        rotation_matrix[:, 2, 1] = cos_angles[:, 1] * sin_angles[:, 2]
-        rotation_matrix[:, 2, 2] = cos_angles[:, 1] * cos_angles[:, 2]
+
+        rotation_matrix = rearrange(rotation_matrix, "b (i j) -> b i j", i=3, j=3)
 
         return rotation_matrix
 
@@ -2810,9 +3375,9 @@ class InputFeatureEmbedder(Module):
 
         self.atompair_feats_mlp = nn.Sequential(
             LinearNoBias(dim_atompair, dim_atompair),
-            nn.ReLU(),
+            nn.ReLU(inplace=True),
             LinearNoBias(dim_atompair, dim_atompair),
-            nn.ReLU(),
+            nn.ReLU(inplace=True),
             LinearNoBias(dim_atompair, dim_atompair),
         )
 
@@ -2889,11 +3454,10 @@ class InputFeatureEmbedder(Module):
         atom_feats_cond_row, atom_feats_cond_col = atom_feats_cond.chunk(2, dim=-1)
         atom_feats_cond_col = concat_previous_window(atom_feats_cond_col, dim_seq=1, dim_window=-2)
 
-        atompair_feats = einx.add(
-            "b nw w1 w2 dap, b nw w1 dap", atompair_feats, atom_feats_cond_row
-        )
-        atompair_feats = einx.add(
-            "b nw w1 w2 dap, b nw w2 dap", atompair_feats, atom_feats_cond_col
+        atompair_feats = (
+            atompair_feats
+            + atom_feats_cond_row[:, :, :, None, :]
+            + atom_feats_cond_col[:, :, None, :, :]
         )
 
         # initial atom transformer
@@ -2923,8 +3487,8 @@ class InputFeatureEmbedder(Module):
         single_molecule_embed = self.single_molecule_embed(molecule_ids)
 
         pairwise_molecule_embed = self.pairwise_molecule_embed(molecule_ids)
-        pairwise_molecule_embed = einx.add(
-            "b i dp, b j dp -> b i j dp", pairwise_molecule_embed, pairwise_molecule_embed
+        pairwise_molecule_embed = (
+            pairwise_molecule_embed[:, :, None, :] + pairwise_molecule_embed[:, None, :, :]
         )
 
         # sum to single init and pairwise init, equivalent to one-hot in additional residue features
@@ -2991,13 +3555,22 @@ class ConfidenceHead(Module):
     """Algorithm 31."""
 
     @typecheck
-    def __init__(self, *, dim_single_inputs, atompair_dist_bins: List[float], dim_single=384, dim_pairwise=128, num_plddt_bins=50, num_pde_bins=64, num_pae_bins=64, pairformer_depth=4, pairformer_kwargs: dict = dict()):  # type: ignore
+    def __init__(self, *, dim_single_inputs, atompair_dist_bins: List[float], dim_single=384, dim_pairwise=128, num_plddt_bins=50, num_pde_bins=64, num_pae_bins=64, pairformer_depth=4, pairformer_kwargs: dict = dict(), enable_bf16_autocast=False):  # type: ignore
         super().__init__()
 
         atompair_dist_bins = Tensor(atompair_dist_bins)
 
         self.register_buffer("atompair_dist_bins", atompair_dist_bins)
 
+        # the nearest of the sorted distance bins is found by bucketizing with the midpoints
+        # between consecutive bins, without materializing the distance to each of the bins
+
+        self.register_buffer(
+            "atompair_dist_bin_boundaries",
+            (atompair_dist_bins[:-1] + atompair_dist_bins[1:]) / 2,
+            persistent=False,
+        )
+
         num_dist_bins = atompair_dist_bins.shape[-1]
         self.num_dist_bins = num_dist_bins
 
@@ -3013,6 +3586,11 @@ class ConfidenceHead(Module):
             **pairformer_kwargs,
         )
 
+        # optionally run the pairformer stack of the head in bfloat16 - its inputs are detached
+        # from the trunk, so only the gradients of the head itself see the reduced precision
+
+        self.enable_bf16_autocast = enable_bf16_autocast
+
         # to predictions
 
         self.to_pae_logits = nn.Sequential(
@@ -3034,6 +3612,39 @@ class ConfidenceHead(Module):
             LinearNoBias(dim_single, 2), Rearrange("b ... l -> b l ...")
         )
 
+    def to_logits(
+        self,
+        single_repr: Float["b n ds"],  # type: ignore
+        pairwise_repr: Float["b n n dp"],  # type: ignore
+        return_pae_logits: bool = True,
+    ) -> ConfidenceHeadLogits:
+        """
+        Project the single and pairwise representations to the confidence head logits.
+
+        :param single_repr: The single representation tensor.
+        :param pairwise_repr: The pairwise representation tensor.
+        :param return_pae_logits: Whether to return the predicted aligned error (PAE) logits.
+        :return: The confidence head logits.
+        """
+
+        # the pde logits of the symmetrized pairwise representation are symmetrized after the
+        # bias-free projection, which is equivalent, but adds far fewer bins than features
+
+        pde_logits = self.to_pde_logits(pairwise_repr)
+        pde_logits = pde_logits + pde_logits.transpose(-1, -2)
+
+        plddt_logits = self.to_plddt_logits(single_repr)
+        resolved_logits = self.to_resolved_logits(single_repr)
+
+        # they only incorporate pae at some stage of training
+
+        pae_logits = None
+
+        if return_pae_logits:
+            pae_logits = self.to_pae_logits(pairwise_repr)
+
+        return ConfidenceHeadLogits(pae_logits, pde_logits, plddt_logits, resolved_logits)
+
     @typecheck
     def forward(
         self,
@@ -3057,44 +3668,33 @@ class ConfidenceHead(Module):
         :return: The confidence head logits.
         """
 
-        pairwise_repr = pairwise_repr + self.single_inputs_to_pairwise(single_inputs_repr)
+        pairwise_repr = self.single_inputs_to_pairwise(single_inputs_repr, residual=pairwise_repr)
 
         # interatomic distances - embed and add to pairwise
 
-        interatom_dist = torch.cdist(pred_atom_pos, pred_atom_pos, p=2)
+        interatom_dist = pairwise_distances(pred_atom_pos)
 
-        dist_from_dist_bins = einx.subtract(
-            "b m dist, dist_bins -> b m dist dist_bins",
-            interatom_dist,
-            self.atompair_dist_bins,
-        ).abs()
-        dist_bin_indices = dist_from_dist_bins.argmin(dim=-1)
+        dist_bin_indices = torch.bucketize(interatom_dist, self.atompair_dist_bin_boundaries)
         pairwise_repr = pairwise_repr + self.dist_bin_pairwise_embed(dist_bin_indices)
 
         # pairformer stack
 
-        single_repr, pairwise_repr = self.pairformer_stack(
-            single_repr=single_repr, pairwise_repr=pairwise_repr, mask=mask
-        )
-
-        # to logits
-
-        symmetric_pairwise_repr = pairwise_repr + rearrange(pairwise_repr, "b i j d -> b j i d")
-        pde_logits = self.to_pde_logits(symmetric_pairwise_repr)
-
-        plddt_logits = self.to_plddt_logits(single_repr)
-        resolved_logits = self.to_resolved_logits(single_repr)
-
-        # they only incorporate pae at some stage of training
+        dtype = pairwise_repr.dtype
 
-        pae_logits = None
+        with torch.autocast(
+            device_type=pairwise_repr.device.type,
+            dtype=torch.bfloat16,
+            enabled=self.enable_bf16_autocast,
+        ):
+            single_repr, pairwise_repr = self.pairformer_stack(
+                single_repr=single_repr, pairwise_repr=pairwise_repr, mask=mask
+            )
 
-        if return_pae_logits:
-            pae_logits = self.to_pae_logits(pairwise_repr)
+        single_repr, pairwise_repr = single_repr.type(dtype), pairwise_repr.type(dtype)
 
-        # return all logits
+        # to logits
 
-        return ConfidenceHeadLogits(pae_logits, pde_logits, plddt_logits, resolved_logits)
+        return self.to_logits(single_repr, pairwise_repr, return_pae_logits=return_pae_logits)
 
 
 # main class
@@ -3209,6 +3809,7 @@ class Alphafold3(Module):
         ),
         augment_kwargs: dict = dict(),
         stochastic_frame_average=False,
+        stream_diffusion_augmentations=False,
     ):
         super().__init__()
 
@@ -3239,6 +3840,7 @@ class Alphafold3(Module):
 
         self.num_augmentations = diffusion_num_augmentations
         self.augmenter = CentreRandomAugmentation(**augment_kwargs)
+        self.stream_diffusion_augmentations = stream_diffusion_augmentations
 
         # stochastic frame averaging
         # https://arxiv.org/abs/2305.05577
@@ -3348,6 +3950,13 @@ class Alphafold3(Module):
         distance_bins_tensor = Tensor(distance_bins)
 
         self.register_buffer("distance_bins", distance_bins_tensor)
+
+        self.register_buffer(
+            "distance_bin_boundaries",
+            (distance_bins_tensor[:-1] + distance_bins_tensor[1:]) / 2,
+            persistent=False,
+        )
+
         num_dist_bins = default(num_dist_bins, len(distance_bins_tensor))
 
         assert (
@@ -3496,6 +4105,7 @@ class Alphafold3(Module):
         return_loss: bool = None,
         num_rollout_steps: int = 20,
         rollout_show_tqdm_pbar: bool = False,
+        use_rollout_for_confidence: bool = True,
     ) -> Float["b m 3"] | Float[""] | Tuple[Float[""], LossBreakdown]:  # type: ignore
         """
         Run the forward pass of AlphaFold 3.
@@ -3525,6 +4135,9 @@ class Alphafold3(Module):
         :param return_loss: Whether to return the loss.
         :param num_rollout_steps: The number of rollout steps.
         :param rollout_show_tqdm_pbar: Whether to show a tqdm progress bar during rollout.
+        :param use_rollout_for_confidence: Whether to train the confidence head on the atom
+            positions of a sampling rollout, rather than on the single step denoised atom
+            positions of the diffusion loss, which skips the rollout entirely.
         :return: The atomic coordinates or the loss.
         """
         atom_seq_len = atom_inputs.shape[-2]
@@ -3629,17 +4242,17 @@ class Alphafold3(Module):
         is_chained_biomol = is_molecule_types[..., :3].any(
             dim=-1
         )  # first three types are chained biomolecules (protein, rna, dna)
-        paired_is_chained_biomol = einx.logical_and(
-            "b i, b j -> b i j", is_chained_biomol, is_chained_biomol
-        )
+        paired_is_chained_biomol = is_chained_biomol[:, :, None] & is_chained_biomol[:, None, :]
 
-        relative_position_encoding = einx.where(
-            "b i j, b i j d, -> b i j d", paired_is_chained_biomol, relative_position_encoding, 0.0
+        relative_position_encoding = torch.where(
+            paired_is_chained_biomol[..., None], relative_position_encoding, 0.0
         )
 
         # add relative positional encoding to pairwise init
+        # the pairwise init is freshly computed, and not needed for any backward, so the relative
+        # positional encoding and token bond features are accumulated into it in place
 
-        pairwise_init = pairwise_init + relative_position_encoding
+        pairwise_init.add_(relative_position_encoding)
 
         # token bond features
 
@@ -3648,22 +4261,24 @@ class Alphafold3(Module):
             # (1) mask out diagonal - token to itself does not count as a bond
             # (2) symmetrize, in case it is not already symmetrical (could also throw an error)
 
+            # the symmetrized token bonds are a fresh tensor, so the diagonal is cleared in place
+            # through a view, without materializing an identity mask
+
             token_bonds = token_bonds | rearrange(token_bonds, "b i j -> b j i")
-            diagonal = torch.eye(seq_len, device=self.device, dtype=torch.bool)
-            token_bonds = token_bonds.masked_fill(diagonal, False)
+            token_bonds.diagonal(dim1=-2, dim2=-1).fill_(False)
         else:
             seq_arange = torch.arange(seq_len, device=self.device)
-            token_bonds = einx.subtract("i, j -> i j", seq_arange, seq_arange).abs() == 1
+            token_bonds = (seq_arange[:, None] - seq_arange).abs() == 1
 
         token_bonds_feats = self.token_bond_to_pairwise_feat(token_bonds.float())
 
-        pairwise_init = pairwise_init + token_bonds_feats
+        pairwise_init.add_(token_bonds_feats)
 
         # molecule mask and pairwise mask
 
         mask = molecule_atom_lens > 0
 
-        pairwise_mask = einx.logical_and("b i, b j -> b i j", mask, mask)
+        pairwise_mask = mask[:, :, None] & mask[:, None, :]
 
         # prepare mask for msa module and template embedder
         # which is equivalent to the `is_protein` of the `is_molecular_types` input
@@ -3672,24 +4287,26 @@ class Alphafold3(Module):
 
         # init recycled single and pairwise
 
-        recycled_pairwise = recycled_single = None
         single = pairwise = None
 
-        # for each recycling step
+        # the template features are embedded once for all recycling steps
 
-        for _ in range(num_recycling_steps):
-            # handle recycled single and pairwise if not first step
+        embedded_templates = None
 
-            recycled_single = recycled_pairwise = 0.0
+        if exists(templates):
+            embedded_templates = self.template_embedder.embed_templates(templates)
 
-            if exists(single):
-                recycled_single = self.recycle_single(single)
+        # for each recycling step
 
-            if exists(pairwise):
-                recycled_pairwise = self.recycle_pairwise(pairwise)
+        for _ in range(num_recycling_steps):
+            # handle recycled single and pairwise if not first step,
+            # the first step starts from the initial single and pairwise as is
 
-            single = single_init + recycled_single
-            pairwise = pairwise_init + recycled_pairwise
+            if exists(single):
+                single = single_init + self.recycle_single(single)
+                pairwise = pairwise_init + self.recycle_pairwise(pairwise)
+            else:
+                single, pairwise = single_init, pairwise_init
 
             # else go through main transformer trunk from alphafold2
 
@@ -3701,6 +4318,7 @@ class Alphafold3(Module):
                     template_mask=template_mask,
                     pairwise_repr=pairwise,
                     mask=is_protein_mask,
+                    embedded_templates=embedded_templates,
                 )
 
                 pairwise = embedded_template + pairwise
@@ -3785,18 +4403,22 @@ class Alphafold3(Module):
         # distogram head
 
         if not exists(distance_labels) and atom_pos_given and exists(molecule_atom_indices):
-            molecule_pos = einx.get_at("b [m] c, b n -> b n c", atom_pos, molecule_atom_indices)
+            molecule_pos = torch.gather(
+                atom_pos, 1, molecule_atom_indices[..., None].expand(-1, -1, atom_pos.shape[-1])
+            )
 
-            molecule_dist = torch.cdist(molecule_pos, molecule_pos, p=2)
-            dist_from_dist_bins = einx.subtract(
-                "b m dist, dist_bins -> b m dist dist_bins",
-                molecule_dist,
-                self.distance_bins,
-            ).abs()
-            distance_labels = dist_from_dist_bins.argmin(dim=-1)
+            molecule_dist = pairwise_distances(molecule_pos)
+            distance_labels = torch.bucketize(molecule_dist, self.distance_bin_boundaries)
 
-        if exists(distance_labels):
+            # the derived labels are owned here, so the padding is ignored in place, while
+            # labels that are passed in are never written to
+
+            distance_labels.masked_fill_(~pairwise_mask, ignore)
+
+        elif exists(distance_labels):
             distance_labels = torch.where(pairwise_mask, distance_labels, ignore)
+
+        if exists(distance_labels):
             distogram_logits = self.distogram_head(pairwise)
             distogram_loss = F.cross_entropy(
                 distogram_logits, distance_labels, ignore_index=ignore
@@ -3812,7 +4434,12 @@ class Alphafold3(Module):
             # take care of augmentation
             # they did 48 during training, as the trunk did the heavy lifting
 
-            if num_augs > 1:
+            # optionally stream the augmentations through the diffusion module one at a time,
+            # rather than repeating all of the inputs (including the pairwise trunk) for each
+
+            stream_augs = self.stream_diffusion_augmentations and num_augs > 1
+
+            if num_augs > 1 and not stream_augs:
                 (
                     atom_pos,
                     atom_mask,
@@ -3874,13 +4501,7 @@ class Alphafold3(Module):
                 if self.stochastic_frame_average:
                     atom_pos = torch.cat((fa_atom_pos, atom_pos), dim=0)
 
-            (
-                diffusion_loss,
-                denoised_atom_pos,
-                diffusion_loss_breakdown,
-                _,
-            ) = self.edm(
-                atom_pos,
+            diffusion_kwargs = dict(
                 additional_molecule_feats=additional_molecule_feats,
                 is_molecule_types=is_molecule_types,
                 add_smooth_lddt_loss=diffusion_add_smooth_lddt_loss,
@@ -3898,31 +4519,73 @@ class Alphafold3(Module):
                 return_denoised_pos=True,
             )
 
+            if not stream_augs:
+                (
+                    diffusion_loss,
+                    denoised_atom_pos,
+                    diffusion_loss_breakdown,
+                    _,
+                ) = self.edm(atom_pos, **diffusion_kwargs)
+
+            else:
+                aug_losses = []
+                aug_loss_breakdowns = []
+
+                for aug_index in range(num_augs):
+                    # the first augmentation is the stochastic frame averaged position, if used
+
+                    if self.stochastic_frame_average and aug_index == 0:
+                        aug_atom_pos = self.frame_average(atom_pos, frame_average_mask=atom_mask)
+                    else:
+                        aug_atom_pos = self.augmenter(atom_pos)
+
+                    (
+                        aug_loss,
+                        denoised_atom_pos,
+                        aug_loss_breakdown,
+                        _,
+                    ) = self.edm(aug_atom_pos, **diffusion_kwargs)
+
+                    aug_losses.append(aug_loss)
+                    aug_loss_breakdowns.append(aug_loss_breakdown)
+
+                # every augmentation has the same number of atoms, so the mean of the
+                # per augmentation losses is the loss over all of the augmentations
+
+                diffusion_loss = torch.stack(aug_losses).mean()
+
+                diffusion_loss_breakdown = DiffusionLossBreakdown(
+                    *(torch.stack(losses).mean() for losses in zip(*aug_loss_breakdowns))
+                )
+
         # confidence head
 
         should_call_confidence_head = any([*map(exists, confidence_head_labels)])
         return_pae_logits = exists(pae_labels)
 
         if calc_diffusion_loss and should_call_confidence_head:
-            # rollout
-
-            denoised_atom_pos = self.edm.sample(
-                num_sample_steps=num_rollout_steps,
-                atom_feats=atom_feats,
-                atompair_feats=atompair_feats,
-                atom_mask=atom_mask,
-                mask=mask,
-                single_trunk_repr=single,
-                single_inputs_repr=single_inputs,
-                pairwise_trunk=pairwise,
-                pairwise_rel_pos_feats=relative_position_encoding,
-                molecule_atom_lens=molecule_atom_lens,
-                use_tqdm_pbar=rollout_show_tqdm_pbar,
-                tqdm_pbar_title="Training rollout",
-            )
+            # rollout, unless the denoised atom positions of the diffusion loss are used as is
+
+            if use_rollout_for_confidence:
+                denoised_atom_pos = self.edm.sample(
+                    num_sample_steps=num_rollout_steps,
+                    atom_feats=atom_feats,
+                    atompair_feats=atompair_feats,
+                    atom_mask=atom_mask,
+                    mask=mask,
+                    single_trunk_repr=single,
+                    single_inputs_repr=single_inputs,
+                    pairwise_trunk=pairwise,
+                    pairwise_rel_pos_feats=relative_position_encoding,
+                    molecule_atom_lens=molecule_atom_lens,
+                    use_tqdm_pbar=rollout_show_tqdm_pbar,
+                    tqdm_pbar_title="Training rollout",
+                )
 
-            pred_atom_pos = einx.get_at(
-                "b [m] c, b n -> b n c", denoised_atom_pos, molecule_atom_indices
+            pred_atom_pos = torch.gather(
+                denoised_atom_pos,
+                1,
+                molecule_atom_indices[..., None].expand(-1, -1, denoised_atom_pos.shape[-1]),
             )
 
             logits = self.confidence_head(
@@ -3974,7 +4637,9 @@ class Alphafold3(Module):
             resolved=resolved_loss,
             distogram=distogram_loss,
             confidence=confidence_loss,
-            **diffusion_loss_breakdown._asdict(),
+            diffusion_mse=diffusion_loss_breakdown.diffusion_mse,
+            diffusion_bond=diffusion_loss_breakdown.diffusion_bond,
+            diffusion_smooth_lddt=diffusion_loss_breakdown.diffusion_smooth_lddt,
         )
 
         return loss, loss_breakdown
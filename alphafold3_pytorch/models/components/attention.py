@@ -2,16 +2,13 @@ from __future__ import annotations
 
 from typing import NamedTuple
 
-import einx
 import torch
 import torch.nn.functional as F
-from einops import einsum, rearrange, repeat
-from einops.layers.torch import Rearrange
+from einops import rearrange, repeat
 from torch import nn
 from torch.nn import Module
 
 from alphafold3_pytorch.utils.model_utils import (
-    concat_previous_window,
     max_neg_value,
     pad_at_dim,
     softclamp_value,
@@ -44,22 +41,29 @@ def full_pairwise_repr_to_windowed(
     :param window_size: The window size.
     :return: The local windowed pairwise representation matrix.
     """
-    seq_len, device = pairwise_repr.shape[-2], pairwise_repr.device
+    seq_len = pairwise_repr.shape[-2]
 
     padding_needed = (window_size - (seq_len % window_size)) % window_size
-    pairwise_repr = F.pad(pairwise_repr, (0, 0, 0, padding_needed, 0, padding_needed), value=0.0)
+
+    if padding_needed > 0:
+        pairwise_repr = F.pad(
+            pairwise_repr, (0, 0, 0, padding_needed, 0, padding_needed), value=0.0
+        )
+
     pairwise_repr = rearrange(
         pairwise_repr, "... (i w1) (j w2) d -> ... i j w1 w2 d", w1=window_size, w2=window_size
     )
-    pairwise_repr = concat_previous_window(pairwise_repr, dim_seq=-4, dim_window=-2)
 
-    # get the diagonal
+    # only the blocks on the diagonal, and the ones just below it for the previous window, are
+    # gathered as strided views, rather than concatenating the previous window for all blocks
 
-    n = torch.arange(pairwise_repr.shape[-4], device=device)
+    diagonal_blocks = pairwise_repr.diagonal(dim1=-5, dim2=-4)
+    previous_blocks = pairwise_repr.diagonal(offset=-1, dim1=-5, dim2=-4)
+    previous_blocks = F.pad(previous_blocks, (1, 0), value=0.0)
 
-    pairwise_repr = einx.get_at("... [i j] w1 w2 d, n, n -> ... n w1 w2 d", pairwise_repr, n, n)
+    pairwise_repr = torch.cat((previous_blocks, diagonal_blocks), dim=-3)
 
-    return pairwise_repr
+    return pairwise_repr.movedim(-1, -4)
 
 
 @typecheck
@@ -100,6 +104,7 @@ class Attention(Module):
         efficient_attn_config: AttentionConfig = AttentionConfig(True, True, True),
         enable_attn_softclamp=False,
         attn_softclamp_value=30.0,
+        flash_bf16_autocast=False,
     ):
         super().__init__()
         """
@@ -124,10 +129,12 @@ class Attention(Module):
             attn_config=efficient_attn_config,
             enable_attn_softclamp=enable_attn_softclamp,
             attn_softclamp_value=attn_softclamp_value,
+            flash_bf16_autocast=flash_bf16_autocast,
         )
 
-        self.split_heads = Rearrange("b n (h d) -> b h n d", h=heads)
-        self.merge_heads = Rearrange("b h n d -> b n (h d)")
+        # the heads are split and merged with views and a transpose in the forward
+
+        self.heads = heads
 
         self.to_q = nn.Linear(dim, dim_inner, bias=query_bias)
         self.to_kv = nn.Linear(dim, dim_inner * 2, bias=False)
@@ -151,6 +158,33 @@ class Attention(Module):
 
             self.to_gates = gate_linear
 
+    def gate_and_combine_heads(
+        self,
+        out: Float["b h i dh"],  # type: ignore
+        seq: Float["b i d"],  # type: ignore
+    ) -> Float["b i d"]:  # type: ignore
+        """
+        Merge the attended heads, gate them, and project them out.
+
+        :param out: The attention output of each head.
+        :param seq: The input sequence, from which the gates are derived.
+        :return: The output sequence.
+        """
+
+        # merge heads
+
+        out = out.transpose(1, 2).flatten(2)
+
+        # gate output
+
+        if exists(self.to_gates):
+            gates = self.to_gates(seq)
+            out = out * gates.sigmoid()
+
+        # combine heads
+
+        return self.to_out(out)
+
     @typecheck
     def forward(
         self,
@@ -175,7 +209,7 @@ class Attention(Module):
         context_seq = default(context, seq)
         k, v = self.to_kv(context_seq).chunk(2, dim=-1)
 
-        q, k, v = tuple(self.split_heads(t) for t in (q, k, v))
+        q, k, v = tuple(t.unflatten(-1, (self.heads, -1)).transpose(1, 2) for t in (q, k, v))
 
         # attention
 
@@ -189,19 +223,9 @@ class Attention(Module):
             memory_kv=self.memory_kv,
         )
 
-        # merge heads
+        # merge heads, gate and combine
 
-        out = self.merge_heads(out)
-
-        # gate output
-
-        if exists(self.to_gates):
-            gates = self.to_gates(seq)
-            out = out * gates.sigmoid()
-
-        # combine heads
-
-        return self.to_out(out)
+        return self.gate_and_combine_heads(out, seq)
 
 
 # attending, both vanilla as well as in-built flash attention
@@ -219,6 +243,7 @@ class Attend(Module):
         attn_config: AttentionConfig = AttentionConfig(True, True, True),
         enable_attn_softclamp=False,
         attn_softclamp_value=30.0,
+        flash_bf16_autocast=False,
     ):
         super().__init__()
         """
@@ -254,6 +279,11 @@ class Attend(Module):
         self.enable_attn_softclamp = enable_attn_softclamp
         self.attn_softclamp_value = attn_softclamp_value
 
+        # optionally run the fused scaled dot product attention kernels under bfloat16 autocast,
+        # as the flash kernel only supports half precision inputs
+
+        self.flash_bf16_autocast = flash_bf16_autocast
+
     @typecheck
     def flash_attn(
         self,
@@ -261,6 +291,7 @@ class Attend(Module):
         k: Float["b h j d"],  # type: ignore
         v: Float["b h j d"],  # type: ignore
         mask: Bool["b j"] | None = None,  # type: ignore
+        attn_bias: Float["... i j"] | None = None,  # type: ignore
     ) -> Float["b h i d"]:  # type: ignore
         """
         Run flash attention.
@@ -269,17 +300,42 @@ class Attend(Module):
         :param k: The key tensor.
         :param v: The value tensor.
         :param mask: The mask to apply to the sequence.
+        :param attn_bias: The attention bias to apply.
         :return: The output tensor.
         """
 
-        _, heads, seq_len, _ = q.shape
+        batch = q.shape[0]
+
+        # the key mask is broadcasted by the kernels across heads and queries,
+        # rather than being materialized for each of them
 
         attn_mask = None
 
         if exists(mask):
-            mask = repeat(mask, "b j -> b h i j", h=heads, i=seq_len)
+            attn_mask = rearrange(mask, "b j -> b 1 1 j")
+
+        # an attention bias is passed to the fused kernel as an additive attention mask,
+        # into which the boolean mask is folded
+
+        if exists(attn_bias):
+            # the memory efficient kernel expects a 4-dimensional bias, so one broadcasted
+            # across groups of the batch (e.g. triangle attention rows) is expanded here
+
+            if attn_bias.ndim == 5:
+                attn_bias = repeat(
+                    attn_bias,
+                    "b 1 h i j -> (b n) h i j",
+                    n=batch // attn_bias.shape[0],
+                )
+
+            if exists(attn_mask):
+                attn_bias = attn_bias.masked_fill(~attn_mask, max_neg_value(attn_bias))
 
-        with torch.backends.cuda.sdp_kernel(**self.attn_config._asdict()):
+            attn_mask = attn_bias.type(q.dtype)
+
+        with torch.backends.cuda.sdp_kernel(**self.attn_config._asdict()), torch.autocast(
+            device_type=q.device.type, dtype=torch.bfloat16, enabled=self.flash_bf16_autocast
+        ):
             out = F.scaled_dot_product_attention(
                 q,
                 k,
@@ -289,7 +345,67 @@ class Attend(Module):
                 dropout_p=self.dropout if self.training else 0.0,
             )
 
-        return out
+        return out.type(q.dtype)
+
+    @typecheck
+    def local_flash_attn(
+        self,
+        q: Float["b h nw w d"],  # type: ignore
+        k: Float["b h nw wk d"],  # type: ignore
+        v: Float["b h nw wk d"],  # type: ignore
+        mask: Bool["b nw wk"],  # type: ignore
+        windowed_mask: Bool["b nw w wk"] | None = None,  # type: ignore
+        attn_bias: Float["b nw w wk"] | Float["b h nw w wk"] | None = None,  # type: ignore
+    ) -> Float["b h nw w d"]:  # type: ignore
+        """
+        Run flash attention over the local attention windows.
+
+        :param q: The windowed query tensor.
+        :param k: The windowed key tensor.
+        :param v: The windowed value tensor.
+        :param mask: The windowed mask to apply to the keys.
+        :param windowed_mask: The mask to apply within each window.
+        :param attn_bias: The windowed attention bias to apply.
+        :return: The windowed output tensor.
+        """
+        num_windows = q.shape[2]
+
+        # fold the windows into the batch, as the fused kernels expect 4-dimensional inputs
+
+        q, k, v = tuple(rearrange(t, "b h n w d -> (b n) h w d") for t in (q, k, v))
+
+        mask = rearrange(mask, "b n j -> (b n) 1 1 j")
+
+        if exists(windowed_mask):
+            mask = mask & rearrange(windowed_mask, "b n i j -> (b n) 1 i j")
+
+        # the masks are folded into an additive bias, with a finite fill value so that
+        # fully masked windows of padding do not produce nans
+
+        if exists(attn_bias):
+            if attn_bias.ndim == 4:
+                attn_bias = rearrange(attn_bias, "b ... -> b 1 ...")
+
+            attn_bias = rearrange(attn_bias, "b h n i j -> (b n) h i j")
+        else:
+            attn_bias = torch.zeros(mask.shape, device=q.device, dtype=q.dtype)
+
+        attn_mask = attn_bias.masked_fill(~mask, max_neg_value(attn_bias)).type(q.dtype)
+
+        with torch.backends.cuda.sdp_kernel(**self.attn_config._asdict()), torch.autocast(
+            device_type=q.device.type, dtype=torch.bfloat16, enabled=self.flash_bf16_autocast
+        ):
+            out = F.scaled_dot_product_attention(
+                q,
+                k,
+                v,
+                attn_mask=attn_mask,
+                dropout_p=self.dropout if self.training else 0.0,
+            )
+
+        out = out.type(q.dtype)
+
+        return rearrange(out, "(b n) h w d -> b h n w d", n=num_windows)
 
     @typecheck
     def local_attn(
@@ -331,45 +447,43 @@ class Attend(Module):
         padding_needed = (window_size - (seq_len % window_size)) % window_size
 
         if padding_needed > 0:
-            q, k, v = tuple(
-                pad_at_dim(t, (0, padding_needed), value=0.0, dim=-2) for t in (q, k, v)
-            )
-            mask = F.pad(mask, (0, padding_needed), value=False)
+            q = pad_at_dim(q, (0, padding_needed), value=0.0, dim=-2)
 
         # break into windows
 
-        q, k, v = tuple(rearrange(t, "b h (n w) d -> b h n w d", w=window_size) for t in (q, k, v))
-        mask = rearrange(mask, "b (n w) -> b n w", w=window_size)
+        q = rearrange(q, "b h (n w) d -> b h n w d", w=window_size)
 
         # just do radius of 1 for now
         # perhaps not even necessary, and could try shifted windows (a la Swin)
 
-        k, v = tuple(pad_at_dim(t, (1, 0), dim=-2) for t in (k, v))
-        mask = F.pad(mask, (1, 0), value=False)
-
-        k, v = tuple(torch.cat((t[..., :-1, :], t[..., 1:, :]), dim=-2) for t in (k, v))
-        mask = torch.cat((mask[..., :-1], mask[..., 1:]), dim=-1)
+        # each window of keys / values is the previous window concatenated with the current one,
+        # taken as overlapping strided views of the sequence padded with one window at the start
+        # the keys / values and their mask are padded once, at the start and to the window multiple
 
-        # handle attention bias (inefficiently)
+        kv_padding = (window_size, padding_needed)
 
-        is_full_attn_bias = attn_bias.shape[-1] == attn_bias.shape[-2]
-
-        if exists(attn_bias) and is_full_attn_bias:
-            attn_bias = full_attn_bias_to_windowed(attn_bias, window_size=window_size)
+        k, v = tuple(
+            pad_at_dim(t, kv_padding, value=0.0, dim=-2)
+            .unfold(-2, window_size * 2, window_size)
+            .transpose(-1, -2)
+            for t in (k, v)
+        )
 
-        # carry out attention as usual
+        mask = F.pad(mask, kv_padding, value=False).unfold(-1, window_size * 2, window_size)
 
-        scale = q.shape[-1] ** -0.5
+        # handle attention bias (inefficiently)
 
-        q = q * scale
+        if exists(attn_bias) and attn_bias.shape[-1] == attn_bias.shape[-2]:
+            attn_bias = full_attn_bias_to_windowed(attn_bias, window_size=window_size)
 
         # append memory key / values for local attention windows
 
         if exists(memory_kv):
-            batch, seq, num_mem_kv = k.shape[0], k.shape[2], memory_kv.shape[-2]
+            batch, seq, num_mem_kv = q.shape[0], q.shape[2], memory_kv.shape[-2]
+
+            # the stacked memory key / values are broadcasted as one zero-stride view
 
-            mk, mv = memory_kv
-            mk, mv = tuple(repeat(t, "h m d -> b h n m d", b=batch, n=seq) for t in (mk, mv))
+            mk, mv = repeat(memory_kv, "kv h m d -> kv b h n m d", b=batch, n=seq)
             k = torch.cat((mk, k), dim=-2)
             v = torch.cat((mv, v), dim=-2)
 
@@ -382,9 +496,26 @@ class Attend(Module):
             if exists(mask):
                 mask = pad_at_dim(mask, (num_mem_kv, 0), value=True)
 
+        # forward to the fused scaled dot product attention kernels if applicable,
+        # with the windows folded into the batch and the masks folded into the attention bias
+
+        if self.flash:
+            out = self.local_flash_attn(
+                q, k, v, mask=mask, windowed_mask=windowed_mask, attn_bias=attn_bias
+            )
+
+            out = rearrange(out, "b h n w d -> b h (n w) d")
+            return out[..., :seq_len, :]
+
+        # carry out attention as usual
+
+        scale = q.shape[-1] ** -0.5
+
+        q = q * scale
+
         # similarity
 
-        sim = einsum(q, k, "... i d, ... j d -> ... i j")
+        sim = q @ k.transpose(-1, -2)
 
         if exists(attn_bias):
             if attn_bias.ndim == 4:
@@ -399,15 +530,14 @@ class Attend(Module):
             sim = softclamp_value(sim, self.attn_softclamp_value)
 
         # windowed masking - for masking out atoms not belonging to the same molecule / polypeptide / nucleic acid in sequence-local attention
+        # the similarities are not needed for any backward, so the masks are filled in place
 
         if exists(windowed_mask):
-            sim = einx.where(
-                "b n i j, b h n i j, -> b h n i j", windowed_mask, sim, max_neg_value(sim)
-            )
+            sim.masked_fill_(~windowed_mask[:, None], max_neg_value(sim))
 
         # mask out buckets of padding
 
-        sim = einx.where("b n j, b h n i j, -> b h n i j", mask, sim, max_neg_value(sim))
+        sim.masked_fill_(~mask[:, None, :, None, :], max_neg_value(sim))
 
         # local attention
 
@@ -415,7 +545,7 @@ class Attend(Module):
 
         # aggregate
 
-        out = einsum(attn, v, "... i j, ... j d -> ... i d")
+        out = attn @ v
 
         # un-window the output
 
@@ -477,8 +607,7 @@ class Attend(Module):
         if exists(memory_kv):
             batch, num_mem_kv = q.shape[0], memory_kv.shape[-2]
 
-            mk, mv = memory_kv
-            mk, mv = tuple(repeat(t, "h m d -> b h m d", b=batch) for t in (mk, mv))
+            mk, mv = repeat(memory_kv, "kv h m d -> kv b h m d", b=batch)
             k = torch.cat((mk, k), dim=-2)
             v = torch.cat((mv, v), dim=-2)
 
@@ -488,15 +617,11 @@ class Attend(Module):
             if exists(mask):
                 mask = pad_at_dim(mask, (num_mem_kv, 0), value=True)
 
-        # forward to using flash attention if applicable
-
-        can_use_flash = (
-            self.flash and not exists(attn_bias),
-            "flash attention does not support attention bias with gradients",
-        )
+        # forward to the fused scaled dot product attention kernels if applicable - an attention
+        # bias is passed along as an additive mask, for which the memory efficient kernel is used
 
-        if can_use_flash:
-            return self.flash_attn(q, k, v, mask=mask)
+        if self.flash:
+            return self.flash_attn(q, k, v, mask=mask, attn_bias=attn_bias)
 
         # default attention
 
@@ -506,11 +631,18 @@ class Attend(Module):
 
         # similarity
 
-        sim = einsum(q, k, "b h i d, b h j d -> b h i j")
+        sim = q @ k.transpose(-1, -2)
 
         # attn bias
+        # an attention bias with an extra dimension is broadcasted across groups of the batch,
+        # e.g. the rows of a pairwise representation in triangle attention
 
-        if exists(attn_bias):
+        if exists(attn_bias) and attn_bias.ndim == 5:
+            sim = rearrange(sim, "(b n) h i j -> b n h i j", b=attn_bias.shape[0])
+            sim = sim + attn_bias
+            sim = rearrange(sim, "b n h i j -> (b n) h i j")
+
+        elif exists(attn_bias):
             sim = sim + attn_bias
 
         # maybe softclamp
@@ -521,7 +653,7 @@ class Attend(Module):
         # masking
 
         if exists(mask):
-            sim = einx.where("b j, b h i j, -> b h i j", mask, sim, max_neg_value(sim))
+            sim.masked_fill_(~mask[:, None, None, :], max_neg_value(sim))
 
         # attention
 
@@ -530,6 +662,6 @@ class Attend(Module):
 
         # aggregate values
 
-        out = einsum(attn, v, "b h i j, b h j d -> b h i d")
+        out = attn @ v
 
         return out
@@ -110,6 +110,25 @@ def exclusive_cumsum(t: Tensor, dim: int = -1) -> Tensor:
     return t.cumsum(dim=dim) - t
 
 
+@typecheck
+def pairwise_distances(x: Float["b n d"]) -> Float["b n n"]:  # type: ignore
+    """
+    Compute the Euclidean distances between all pairs of points, through the expansion
+    ||x_i - x_j||^2 = ||x_i||^2 + ||x_j||^2 - 2 x_i . x_j, as a single batched matrix multiply.
+    Meant for distances that are not differentiated through, e.g., for binning.
+
+    :param x: The points Tensor.
+    :return: The pairwise distances Tensor.
+    """
+    sq_norms = x.pow(2).sum(dim=-1)
+
+    sq_dists = torch.baddbmm(
+        sq_norms[:, :, None] + sq_norms[:, None, :], x, x.transpose(-1, -2), alpha=-2.0
+    )
+
+    return sq_dists.clamp_(min=0.0).sqrt_()
+
+
 # decorators
 
 
@@ -357,9 +376,9 @@ def mean_pool_with_lens(
 
 @typecheck
 def repeat_consecutive_with_lens(
-    feats: Float["b n ..."] | Bool["b n"] | Int["b n"],  # type: ignore
+    feats: Float["b n ..."] | Bool["b n ..."] | Int["b n ..."],  # type: ignore
     lens: Int["b n"],  # type: ignore
-) -> Float["b m ..."] | Bool["b m"] | Int["b m"]:  # type: ignore
+) -> Float["b m ..."] | Bool["b m ..."] | Int["b m ..."]:  # type: ignore
     """
     Repeat a Tensor's values consecutively with the given lengths.
 
@@ -46,7 +46,10 @@ TokenType = AtomType | ResidueType
 
 # NOTE: use env variable `TYPECHECK` (which is set by `rootutils` above using `.env`) to control whether to use `beartype` + `jaxtyping`
 
-should_typecheck = os.environ.get("TYPECHECK", False)
+# any value other than `True` (e.g., `TYPECHECK=False` in production) leaves the runtime
+# checks out of the hot paths entirely, rather than only an unset variable doing so
+
+should_typecheck = os.environ.get("TYPECHECK", "False").lower() == "true"
 
 typecheck = jaxtyped(typechecker=beartype) if should_typecheck else identity
 
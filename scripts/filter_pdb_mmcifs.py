@@ -661,11 +661,12 @@ def get_unique_res_atom_names(mmcif_object: MmcifObject) -> List[List[List[str]]
             residue_constants = get_residue_constants(res_chem_type=res_chem_comp.type)
             if is_polymer_residue:
                 # For polymer residues, append the atom types directly.
-                atoms_to_append = [residue_constants.atom_types]
+                atoms_to_append = [residue_constants.atom_types_padded]
             else:
                 # For non-polymer residues, create a nested list of atom names.
                 atoms_to_append = [
-                    [atom.name for _ in range(residue_constants.atom_type_num)] for atom in res
+                    [atom.name for _ in range(residue_constants.atom_type_num_padded)]
+                    for atom in res
                 ]
             unique_res_atom_names.append(atoms_to_append)
     return unique_res_atom_names
@@ -10,6 +10,7 @@ rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
 
 from alphafold3_pytorch import (
     Alphafold3,
+    Attend,
     Attention,
     CentreRandomAugmentation,
     ComputeAlignmentError,
@@ -32,6 +33,8 @@ from alphafold3_pytorch.data.atom_datamodule import (
     collate_inputs_to_batched_atom_input,
 )
 from alphafold3_pytorch.models.components.alphafold3 import (
+    AdaptiveLayerNorm,
+    LayerNormLinearNoBias,
     full_pairwise_repr_to_windowed,
     mean_pool_with_lens,
     repeat_consecutive_with_lens,
@@ -90,6 +93,25 @@ def test_smooth_lddt_loss():
     assert loss.numel() == 1
 
 
+def test_smooth_lddt_loss_block_size():
+    """Test that computing the smooth lDDT loss over blocks of atoms leaves it unchanged."""
+    pred_coords = torch.randn(2, 100, 3)
+    true_coords = torch.randn(2, 100, 3)
+    is_dna = torch.randint(0, 2, (2, 100)).bool()
+    is_rna = torch.randint(0, 2, (2, 100)).bool()
+    coords_mask = torch.randint(0, 2, (2, 100)).bool()
+
+    loss = SmoothLDDTLoss()(pred_coords, true_coords, is_dna, is_rna, coords_mask)
+
+    # a block size that does not divide the number of atoms leaves a partial last block
+
+    blockwise_loss = SmoothLDDTLoss(block_size=32)(
+        pred_coords, true_coords, is_dna, is_rna, coords_mask
+    )
+
+    assert torch.allclose(loss, blockwise_loss, atol=1e-6)
+
+
 def test_weighted_rigid_align():
     """Test the weighted rigid alignment function."""
     pred_coords = torch.randn(2, 100, 3)
@@ -112,6 +134,22 @@ def test_weighted_rigid_align():
     assert (rmsd < 1e-5).all()
 
 
+def test_weighted_rigid_align_quaternion_kabsch():
+    """Test that the quaternion-based Kabsch solver matches the SVD-based one."""
+    pred_coords = torch.randn(2, 100, 3)
+    true_coords = torch.randn(2, 100, 3)
+    weights = torch.rand(2, 100)
+    mask = torch.randint(0, 2, (2, 100)).bool()
+
+    svd_align_fn = WeightedRigidAlign()
+    quaternion_align_fn = WeightedRigidAlign(use_quaternion_kabsch=True)
+
+    svd_aligned_coords = svd_align_fn(pred_coords, true_coords, weights, mask=mask)
+    quaternion_aligned_coords = quaternion_align_fn(pred_coords, true_coords, weights, mask=mask)
+
+    assert torch.allclose(svd_aligned_coords, quaternion_aligned_coords, atol=1e-5)
+
+
 def test_weighted_rigid_align_with_mask():
     """Test the weighted rigid alignment function with masking."""
     pred_coords = torch.randn(2, 100, 3)
@@ -194,6 +232,48 @@ def test_centre_random_augmentation():
     assert augmented_coords.shape == coords.shape
 
 
+def test_adaptive_layernorm_loads_unpacked_checkpoint():
+    """Test loading a checkpoint with separate gamma and beta projections into the adaptive
+    layernorm."""
+    adaptive_layernorm = AdaptiveLayerNorm(dim=16, dim_cond=8)
+
+    gamma_weight, gamma_bias = torch.randn(16, 8), torch.randn(16)
+    beta_weight = torch.randn(16, 8)
+
+    adaptive_layernorm.load_state_dict(
+        {
+            "norm_cond.weight": torch.ones(8),
+            "to_gamma.0.weight": gamma_weight,
+            "to_gamma.0.bias": gamma_bias,
+            "to_beta.weight": beta_weight,
+        }
+    )
+
+    x = torch.randn(2, 4, 16)
+    cond = torch.randn(2, 4, 8)
+
+    normed = torch.nn.functional.layer_norm(x, (16,))
+    normed_cond = torch.nn.functional.layer_norm(cond, (8,))
+
+    gamma = (normed_cond @ gamma_weight.t() + gamma_bias).sigmoid()
+    beta = normed_cond @ beta_weight.t()
+
+    assert torch.allclose(adaptive_layernorm(x, cond), normed * gamma + beta, atol=1e-5)
+
+
+def test_layernorm_linear_no_bias():
+    """Test that the fused layernorm and projection matches its unfused layout and output."""
+    norm_linear = LayerNormLinearNoBias(16, 4)
+    torch.nn.init.normal_(norm_linear.norm.weight)
+    torch.nn.init.normal_(norm_linear.norm.bias)
+
+    assert list(norm_linear.state_dict().keys()) == ["0.weight", "0.bias", "1.weight"]
+
+    x = torch.randn(2, 8, 16) * 3.0 + 1.0
+
+    assert torch.allclose(norm_linear(x), norm_linear.proj(norm_linear.norm(x)), atol=1e-5)
+
+
 @pytest.mark.parametrize("recurrent_depth", (1, 2))
 @pytest.mark.parametrize("enable_attn_softclamp", (True, False))
 def test_pairformer(recurrent_depth, enable_attn_softclamp):
@@ -215,6 +295,47 @@ def test_pairformer(recurrent_depth, enable_attn_softclamp):
     assert pairwise.shape == pairwise_out.shape
 
 
+def test_pairformer_and_msa_module_checkpoint_layers():
+    """Test that activation checkpointing of the Pairformer stack and the MSA module layers
+    leaves their outputs and gradients unchanged."""
+    single = torch.randn(2, 16, 384)
+    pairwise = torch.randn(2, 16, 16, 128)
+    msa = torch.randn(2, 7, 16, 64)
+    mask = torch.randint(0, 2, (2, 16)).bool()
+
+    no_dropout_block_kwargs = dict(dropout_row_prob=0.0, dropout_col_prob=0.0)
+
+    pairformer_kwargs = dict(
+        depth=2, dropout_row_prob=0.0, pairwise_block_kwargs=no_dropout_block_kwargs
+    )
+    msa_module_kwargs = dict(
+        depth=2, msa_pwa_dropout_row_prob=0.0, pairwise_block_kwargs=no_dropout_block_kwargs
+    )
+
+    for stack_klass, stack_kwargs, stack_inputs in (
+        (PairformerStack, pairformer_kwargs, dict(single_repr=single, pairwise_repr=pairwise)),
+        (MSAModule, msa_module_kwargs, dict(msa=msa, single_repr=single, pairwise_repr=pairwise)),
+    ):
+        stack = stack_klass(**stack_kwargs)
+        checkpointed_stack = stack_klass(**stack_kwargs, checkpoint_layers=True)
+        checkpointed_stack.load_state_dict(stack.state_dict())
+
+        outputs = []
+
+        for module in (stack, checkpointed_stack):
+            out = module(**stack_inputs, mask=mask)
+            out = torch.cat([t.flatten() for t in (out if isinstance(out, tuple) else (out,))])
+            out.sum().backward()
+
+            grads = torch.cat([p.grad.flatten() for p in module.parameters() if exists(p.grad)])
+            outputs.append((out, grads))
+
+        (out, grads), (checkpointed_out, checkpointed_grads) = outputs
+
+        assert torch.allclose(out, checkpointed_out, atol=1e-5)
+        assert torch.allclose(grads, checkpointed_grads, atol=1e-4)
+
+
 def test_msa_module():
     """Test the MSA module."""
     single = torch.randn(2, 16, 384)
@@ -250,6 +371,27 @@ def test_diffusion_transformer(use_linear_attn, use_colt5_attn):
     assert single.shape == single_out.shape
 
 
+def test_diffusion_transformer_parallel_residual():
+    """Test that each layer of the non-serial diffusion transformer updates its input with the
+    sum of its attention, its transition and the residual."""
+    single = torch.randn(2, 16, 384)
+    pairwise = torch.randn(2, 16, 16, 128)
+    mask = torch.randint(0, 2, (2, 16)).bool()
+
+    diffusion_transformer = DiffusionTransformer(depth=1, heads=16, serial=False).eval()
+
+    single_out = diffusion_transformer(
+        single, single_repr=single, pairwise_repr=pairwise, mask=mask
+    )
+
+    *_, attn, transition = diffusion_transformer.layers[0]
+
+    attn_out = attn(single, cond=single, pairwise_repr=pairwise, mask=mask)
+    ff_out = transition(single, cond=single)
+
+    assert torch.allclose(single_out, attn_out + ff_out + single, atol=1e-5)
+
+
 def test_sequence_local_attn():
     """Test the sequence local attention module."""
     atoms = torch.randn(2, 17, 32)
@@ -261,6 +403,33 @@ def test_sequence_local_attn():
     assert out.shape == atoms.shape
 
 
+@pytest.mark.parametrize("flash", (True, False))
+def test_local_attn_matches_block_banded_full_attn(flash):
+    """Test that local attention matches full attention with a block-banded mask, in which
+    each window attends to itself and to the window before it."""
+    batch, heads, seq_len, dim_head, window_size = 2, 2, 10, 8, 4
+
+    q, k, v = (torch.randn(batch, heads, seq_len, dim_head) for _ in range(3))
+    attn_bias = torch.randn(batch, heads, seq_len, seq_len)
+
+    mask = torch.ones(batch, seq_len).bool()
+    mask[1, 8:] = False
+
+    window_ids = torch.arange(seq_len) // window_size
+    window_offsets = window_ids[:, None] - window_ids[None, :]
+    block_banded_mask = (window_offsets == 0) | (window_offsets == 1)
+
+    sim = (q @ k.transpose(-1, -2)) * dim_head**-0.5 + attn_bias
+    sim = sim.masked_fill(~(block_banded_mask & mask[:, None, None, :]), -1e9)
+    full_attn_out = sim.softmax(dim=-1) @ v
+
+    attend = Attend(flash=flash, window_size=window_size)
+    local_attn_out = attend(q, k, v, mask=mask, attn_bias=attn_bias)
+
+    assert torch.allclose(local_attn_out[0], full_attn_out[0], atol=1e-5)
+    assert torch.allclose(local_attn_out[1, :, :8], full_attn_out[1, :, :8], atol=1e-5)
+
+
 def test_diffusion_module():
     """Test the diffusion module."""
     seq_len = 16
@@ -372,6 +541,30 @@ def test_template_embed():
     assert exists(template_embed)
 
 
+def test_layernorm_linear_no_bias_checkpoint_keys():
+    """Test that the fused layernorm projections keep the parameter names of older
+    checkpoints."""
+    template_embedder_keys = TemplateEmbedder(dim_template_feats=77).state_dict().keys()
+
+    assert {
+        "pairwise_to_embed_input.0.weight",
+        "pairwise_to_embed_input.0.bias",
+        "pairwise_to_embed_input.1.weight",
+    } <= template_embedder_keys
+
+    diffusion_module_keys = DiffusionModule(
+        atoms_per_window=27,
+        dim_pairwise_trunk=128,
+        dim_pairwise_rel_pos_feats=12,
+        atom_encoder_depth=1,
+        atom_decoder_depth=1,
+        token_transformer_depth=1,
+    ).state_dict().keys()
+
+    for name in ("pairwise_repr_to_atompair_feat_cond", "atom_feat_to_atom_pos_update"):
+        assert {f"{name}.0.weight", f"{name}.0.bias", f"{name}.1.weight"} <= diffusion_module_keys
+
+
 def test_confidence_head():
     """Test the confidence head."""
     single_inputs_repr = torch.randn(2, 16, 77)
@@ -675,6 +868,143 @@ def test_alphafold3_force_return_loss():
     assert loss == 0.0
 
 
+@pytest.mark.parametrize("use_rollout_for_confidence", (True, False))
+def test_alphafold3_use_rollout_for_confidence(use_rollout_for_confidence):
+    """Test training the AlphaFold 3 confidence head with and without the sampling rollout."""
+    seq_len = 16
+    molecule_atom_lens = torch.randint(1, 3, (2, seq_len))
+    atom_seq_len = molecule_atom_lens.sum(dim=-1).amax()
+
+    atom_inputs = torch.randn(2, atom_seq_len, 77)
+    atompair_inputs = torch.randn(2, atom_seq_len, atom_seq_len, 5)
+    additional_molecule_feats = torch.randint(0, 2, (2, seq_len, 5))
+    additional_token_feats = torch.randn(2, seq_len, 2)
+    is_molecule_types = torch.randint(0, 2, (2, seq_len, 4)).bool()
+    molecule_ids = torch.randint(0, 32, (2, seq_len))
+
+    atom_pos = torch.randn(2, atom_seq_len, 3)
+    molecule_atom_indices = molecule_atom_lens - 1
+
+    pae_labels = torch.randint(0, 64, (2, seq_len, seq_len))
+    plddt_labels = torch.randint(0, 50, (2, seq_len))
+
+    alphafold3 = Alphafold3(
+        dim_atom_inputs=77,
+        dim_template_feats=44,
+        num_dist_bins=38,
+        diffusion_num_augmentations=2,
+        confidence_head_kwargs=dict(pairformer_depth=1),
+        template_embedder_kwargs=dict(pairformer_stack_depth=1),
+        msa_module_kwargs=dict(depth=1),
+        pairformer_stack=dict(depth=1),
+        diffusion_module_kwargs=dict(
+            atom_encoder_depth=1,
+            token_transformer_depth=1,
+            atom_decoder_depth=1,
+        ),
+    )
+
+    # the rollout samples with the elucidated atom diffusion, which is skipped otherwise
+
+    num_sample_calls = 0
+    sample = alphafold3.edm.sample
+
+    def counting_sample(*args, **kwargs):
+        nonlocal num_sample_calls
+        num_sample_calls += 1
+        return sample(*args, **kwargs)
+
+    alphafold3.edm.sample = counting_sample
+
+    loss, breakdown = alphafold3(
+        num_recycling_steps=1,
+        num_rollout_steps=2,
+        atom_inputs=atom_inputs,
+        molecule_ids=molecule_ids,
+        molecule_atom_lens=molecule_atom_lens,
+        atompair_inputs=atompair_inputs,
+        is_molecule_types=is_molecule_types,
+        additional_molecule_feats=additional_molecule_feats,
+        additional_token_feats=additional_token_feats,
+        atom_pos=atom_pos,
+        molecule_atom_indices=molecule_atom_indices,
+        pae_labels=pae_labels,
+        plddt_labels=plddt_labels,
+        use_rollout_for_confidence=use_rollout_for_confidence,
+        return_loss_breakdown=True,
+    )
+
+    loss.backward()
+
+    assert num_sample_calls == int(use_rollout_for_confidence)
+    assert breakdown.confidence > 0.0 and torch.isfinite(loss)
+
+
+@pytest.mark.parametrize("stream_diffusion_augmentations", (True, False))
+def test_alphafold3_stream_diffusion_augmentations(stream_diffusion_augmentations):
+    """Test the AlphaFold 3 diffusion loss with the augmentations streamed one at a time, or
+    repeated across the batch."""
+    seq_len = 16
+    molecule_atom_lens = torch.randint(1, 3, (2, seq_len))
+    atom_seq_len = molecule_atom_lens.sum(dim=-1).amax()
+
+    atom_inputs = torch.randn(2, atom_seq_len, 77)
+    atompair_inputs = torch.randn(2, atom_seq_len, atom_seq_len, 5)
+    additional_molecule_feats = torch.randint(0, 2, (2, seq_len, 5))
+    additional_token_feats = torch.randn(2, seq_len, 2)
+    is_molecule_types = torch.randint(0, 2, (2, seq_len, 4)).bool()
+    molecule_ids = torch.randint(0, 32, (2, seq_len))
+
+    atom_pos = torch.randn(2, atom_seq_len, 3)
+
+    alphafold3 = Alphafold3(
+        dim_atom_inputs=77,
+        dim_template_feats=44,
+        num_dist_bins=38,
+        diffusion_num_augmentations=3,
+        stream_diffusion_augmentations=stream_diffusion_augmentations,
+        confidence_head_kwargs=dict(pairformer_depth=1),
+        template_embedder_kwargs=dict(pairformer_stack_depth=1),
+        msa_module_kwargs=dict(depth=1),
+        pairformer_stack=dict(depth=1),
+        diffusion_module_kwargs=dict(
+            atom_encoder_depth=1,
+            token_transformer_depth=1,
+            atom_decoder_depth=1,
+        ),
+    )
+
+    # record the batch size of each call to the diffusion module
+
+    diffusion_batch_sizes = []
+
+    alphafold3.diffusion_module.register_forward_pre_hook(
+        lambda _, args: diffusion_batch_sizes.append(args[0].shape[0])
+    )
+
+    loss, breakdown = alphafold3(
+        num_recycling_steps=1,
+        atom_inputs=atom_inputs,
+        molecule_ids=molecule_ids,
+        molecule_atom_lens=molecule_atom_lens,
+        atompair_inputs=atompair_inputs,
+        is_molecule_types=is_molecule_types,
+        additional_molecule_feats=additional_molecule_feats,
+        additional_token_feats=additional_token_feats,
+        atom_pos=atom_pos,
+        return_loss_breakdown=True,
+    )
+
+    loss.backward()
+
+    if stream_diffusion_augmentations:
+        assert diffusion_batch_sizes == [2, 2, 2]
+    else:
+        assert diffusion_batch_sizes == [6]
+
+    assert breakdown.diffusion_mse > 0.0 and torch.isfinite(loss)
+
+
 def test_alphafold3_with_atom_and_bond_embeddings():
     """Test the AlphaFold 3 model with atom and bond embeddings."""
     alphafold3 = Alphafold3(
@@ -0,0 +1,76 @@
+"""This file prepares unit tests for the residue and atom type constants."""
+
+import os
+
+import numpy as np
+import pytest
+import rootutils
+
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+from alphafold3_pytorch.common import (
+    amino_acid_constants,
+    dna_constants,
+    ligand_constants,
+    rna_constants,
+)
+
+os.environ["TYPECHECK"] = "True"
+
+
+def test_pack_chars_u8():
+    """Test packing strings as space-padded or truncated `uint8` character codes."""
+    packed = amino_acid_constants.pack_chars_u8(["A", "BCD", "EF"], width=2)
+
+    assert packed.shape == (3, 2)
+    assert [bytes(row).decode("ascii") for row in packed] == ["A ", "BC", "EF"]
+    assert not packed.flags.writeable
+
+
+@pytest.mark.parametrize(
+    "constants", [amino_acid_constants, dna_constants, rna_constants, ligand_constants]
+)
+def test_atom_type_first_char_u8(constants):
+    """Test the `uint8` codes of the first character of each padded atom type."""
+    first_chars = constants.get_atom_type_first_char_u8()
+
+    assert first_chars.shape == (constants.atom_type_num_padded,)
+    assert bytes(first_chars).decode("ascii") == "".join(
+        atom_type[0] for atom_type in constants.atom_types_padded
+    )
+
+
+@pytest.mark.parametrize("constants", [amino_acid_constants, dna_constants, rna_constants])
+def test_residue_chars_u8(constants):
+    """Test the `uint8` codes of the one-letter residue types and the residue names."""
+    restype_chars = constants.get_restype_chars_u8()
+
+    assert bytes(restype_chars).decode("ascii") == "".join(constants.restypes)
+
+    resname_chars = constants.get_resname_chars_u8()
+
+    assert resname_chars.shape == (len(constants.resnames), 3)
+    assert [bytes(row).decode("ascii").rstrip() for row in resname_chars] == constants.resnames
+
+
+@pytest.mark.parametrize("constants", [amino_acid_constants, dna_constants, rna_constants])
+def test_resname_indices(constants):
+    """Test the vectorized residue name to index lookups against `resname_to_idx`."""
+    resnames = constants.resnames + ["XYZ", "", "ALAA"]
+
+    resname_indices = constants.resname_indices(np.array(resnames, dtype="|S4").reshape(-1, 1))
+
+    assert resname_indices.shape == (len(resnames), 1)
+    assert resname_indices.ravel().tolist() == [
+        constants.resname_to_idx.get(resname, -1) for resname in resnames
+    ]
+
+
+@pytest.mark.parametrize("constants", [amino_acid_constants, dna_constants, rna_constants])
+def test_atom_types_padded(constants):
+    """Test that the padded polymer atom types span the ligand atom types, as residues of all
+    molecule types share the atom dimension of a `Biomolecule`."""
+    assert constants.atom_type_num_padded == ligand_constants.atom_type_num
+    assert len(constants.atom_types_padded) == constants.atom_type_num_padded
+    assert constants.atom_types_padded[: constants.atom_type_num] == constants.atom_types
+    assert "_" not in constants.atom_order
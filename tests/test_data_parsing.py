@@ -3,12 +3,17 @@
 import os
 import random
 
+import numpy as np
 import pytest
 import rootutils
 
 rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
 
-from alphafold3_pytorch.common.biomolecule import _from_mmcif_object
+from alphafold3_pytorch.common.biomolecule import (
+    _from_mmcif_object,
+    atom_id_to_type,
+    atom_ids_to_types,
+)
 from alphafold3_pytorch.data import mmcif_parsing
 
 os.environ["TYPECHECK"] = "True"
@@ -270,3 +275,25 @@ def test_filtered_random_mmcif_objects_parsing(
         for error in parsing_errors:
             print(error)
         raise error
+
+
+def test_atom_ids_to_types() -> None:
+    """Tests that the vectorized atom ID to atom type conversion matches the scalar one."""
+    atom_ids = ["N", "CA", "OXT", "1HB", "2HG1", "OP1", "C5'", "ZN"]
+
+    atom_types = atom_ids_to_types(np.array(atom_ids, dtype="|S4").reshape(2, 4))
+
+    assert atom_types.shape == (2, 4)
+    assert [t.decode("ascii") for t in atom_types.ravel()] == [
+        atom_id_to_type(atom_id) for atom_id in atom_ids
+    ]
+
+    # e.g., a structure without any ligand atoms
+
+    empty_atom_types = atom_ids_to_types(np.array([], dtype="|S4").reshape(0, 4))
+
+    assert empty_atom_types.shape == (0, 4)
+    assert empty_atom_types.dtype == np.dtype("|S1")
+
+    with pytest.raises(ValueError):
+        atom_ids_to_types(np.array(["CA", "123"], dtype="|S4"))
@@ -49,6 +49,9 @@ def test_alphafold3_input():
 
     batched_atom_input = collate_inputs_to_batched_atom_input([atom_input], atoms_per_window=27)
 
+    # the attention biases of the (triangle) attention layers are materialized for all
+    # rows of the pairwise representation, so checkpoint the pairwise stacks to bound memory
+
     alphafold3 = Alphafold3(
         dim_atom_inputs=3,
         dim_atompair_inputs=1,
@@ -57,10 +60,12 @@ def test_alphafold3_input():
         atoms_per_window=27,
         dim_template_feats=44,
         num_dist_bins=38,
-        confidence_head_kwargs=dict(pairformer_depth=1),
+        confidence_head_kwargs=dict(
+            pairformer_depth=1, pairformer_kwargs=dict(checkpoint_layers=True)
+        ),
         template_embedder_kwargs=dict(pairformer_stack_depth=1),
-        msa_module_kwargs=dict(depth=1),
-        pairformer_stack=dict(depth=2),
+        msa_module_kwargs=dict(depth=1, checkpoint_layers=True),
+        pairformer_stack=dict(depth=2, checkpoint_layers=True),
         diffusion_module_kwargs=dict(
             atom_encoder_depth=1,
             token_transformer_depth=1,